@@ -0,0 +1,223 @@
+import os
+import math
+import time
+import heapq
+import logging
+import itertools
+import threading
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Relative inference cost of each exercise model. These are placeholders: every model
+# is the same YOLO pose architecture and none has been profiled separately yet, so all
+# start at 1.0 and the controller's calibration corrects the absolute scale at runtime.
+MODEL_COST = {
+    'regular_deadlift': 1.0,
+    'sumo_deadlift': 1.0,
+    'squat': 1.0,
+    'romanian_deadlift': 1.0,
+    'zercher_squat': 1.0,
+    'front_squat': 1.0,
+}
+
+# CPU seconds per frame: model inference at its fixed input size, plus decode/draw/encode per pixel
+FRAME_COST_SECONDS = float(os.environ.get('FRAME_COST_SECONDS', 0.05))
+PIXEL_COST_SECONDS = float(os.environ.get('PIXEL_COST_SECONDS', 5e-9))
+
+
+def limit_threads(threads):
+    """Cap the intra-op threads torch and OpenCV use for every job in this process.
+
+    Both default to one thread per core, so a single upload would otherwise spread
+    over the cores reserved for live sessions.
+    """
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    cv2.setNumThreads(threads)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_cost(video_path, exercise_type):
+    """Estimate CPU seconds to process a video from its container metadata alone.
+
+    Returns None when the container does not report a frame count.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise IOError("Error opening video file")
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+
+    if frames <= 0:
+        return None
+    per_frame = FRAME_COST_SECONDS * MODEL_COST.get(exercise_type, 1.0) + PIXEL_COST_SECONDS * width * height
+    return frames * per_frame
+
+
+class Ticket:
+    """Admitted work; release() returns its share of the budget"""
+
+    def __init__(self, controller, kind, cost, estimate=None):
+        self.controller = controller
+        self.kind = kind
+        self.cost = cost
+        self.estimate = estimate  # uncalibrated estimate, used to update the calibration
+        self.started = time.perf_counter()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class AdmissionController:
+    """Admits uploads and live sessions against a node-wide CPU budget.
+
+    Uploads share (1 - live_reserve) of the cores: only as many jobs as fit on those
+    cores at job_threads threads each (one core each when job_threads is None) run at
+    a time, and the
+    outstanding estimated work is capped at target_latency seconds of those cores, so
+    an admitted request finishes in predictable time. Requests that don't fit wait in
+    a queue, cheapest first, for up to queue_timeout seconds. Requests above
+    max_request_fraction of the budget are not queued and only run on an otherwise
+    idle node. Live sessions use the reserved cores, which uploads can
+    never take; each session reserves live_session_cores, so the reserve divided by
+    that is the number of concurrent live sessions. The reserve only holds when jobs
+    are actually capped at job_threads with limit_threads(); uncapped, torch spreads
+    each job over every core.
+    """
+
+    def __init__(self, cores=None, live_reserve=0.25, target_latency=120.0, live_session_cores=1.0,
+                 job_threads=None, max_request_fraction=0.5, queue_timeout=30.0, max_queue=16):
+        cores = cores or os.cpu_count() or 1
+        self.live_cores = max(live_session_cores, cores * live_reserve)
+        self.upload_cores = max(1.0, cores - self.live_cores)
+        self.job_threads = job_threads
+        self.max_running = max(1, int(self.upload_cores // (job_threads or 1)))
+        self.budget = self.upload_cores * target_latency
+        self.live_session_cores = live_session_cores
+        self.max_request_cost = self.budget * max_request_fraction
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+
+        self.outstanding = 0.0
+        self.running = 0
+        self.live_in_use = 0.0
+        self.calibration = 1.0  # observed / estimated CPU seconds, learned from finished uploads
+        self.queue = []  # heap of (cost, seq)
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+        self.stats = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected': 0,
+            'live_admitted': 0,
+            'live_rejected': 0,
+        }
+
+    def admit_upload(self, estimated_cost):
+        """Block until the upload may run and return its Ticket, or raise AdmissionRejected"""
+        with self.cond:
+            cost = self.max_request_cost if estimated_cost is None else estimated_cost * self.calibration
+
+            if self._fits(cost):
+                return self._admit(cost, estimated_cost)
+
+            if cost > self.max_request_cost or len(self.queue) >= self.max_queue:
+                self.stats['rejected'] += 1
+                raise AdmissionRejected("Server is busy, try again later", self._retry_after())
+
+            # Queue by cost so cheap requests go first
+            entry = (cost, next(self.sequence))
+            heapq.heappush(self.queue, entry)
+            self.stats['queued'] += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not (self.queue[0] == entry and self._fits(cost)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats['rejected'] += 1
+                        raise AdmissionRejected("Server is busy, try again later", self._retry_after())
+                    self.cond.wait(remaining)
+            finally:
+                self.queue.remove(entry)
+                heapq.heapify(self.queue)
+                self.cond.notify_all()
+            return self._admit(cost, estimated_cost)
+
+    def admit_live(self):
+        with self.cond:
+            if self.live_in_use + self.live_session_cores > self.live_cores:
+                self.stats['live_rejected'] += 1
+                raise AdmissionRejected("Too many live sessions, try again later", 30)
+            self.live_in_use += self.live_session_cores
+            self.stats['live_admitted'] += 1
+            return Ticket(self, 'live', self.live_session_cores)
+
+    def release(self, ticket):
+        with self.cond:
+            if ticket.kind == 'live':
+                self.live_in_use -= ticket.cost
+            else:
+                self.outstanding -= ticket.cost
+                self.running -= 1
+                # Track how far estimates are off so future costs are scaled to match;
+                # an upload keeps about job_threads cores busy, so wall time approximates CPU time
+                observed = (time.perf_counter() - ticket.started) * (self.job_threads or 1)
+                if ticket.estimate:
+                    ratio = observed / ticket.estimate
+                    self.calibration = min(10.0, max(0.1, 0.8 * self.calibration + 0.2 * ratio))
+            self.cond.notify_all()
+
+    def metrics(self):
+        with self.cond:
+            return {
+                'upload_cores': self.upload_cores,
+                'live_cores': self.live_cores,
+                'live_session_cores': self.live_session_cores,
+                'job_threads': self.job_threads,
+                'max_running': self.max_running,
+                'budget_seconds': self.budget,
+                'outstanding_seconds': round(self.outstanding, 2),
+                'running': self.running,
+                'queue_length': len(self.queue),
+                'live_in_use': self.live_in_use,
+                'calibration': round(self.calibration, 3),
+                **self.stats
+            }
+
+    def _fits(self, cost):
+        if self.running >= self.max_running:
+            return False
+        # A request larger than the budget can still run alone on an idle node
+        return self.running == 0 or self.outstanding + cost <= self.budget
+
+    def _admit(self, cost, estimate):
+        self.outstanding += cost
+        self.running += 1
+        self.stats['admitted'] += 1
+        return Ticket(self, 'upload', cost, estimate)
+
+    def _retry_after(self):
+        """Seconds until the outstanding work should have drained"""
+        return max(1, math.ceil(self.outstanding / self.upload_cores))
@@ -1,12 +1,18 @@
 import os
 import logging
+from collections import deque
 import cv2
 import numpy as np
-from flask import Flask, render_template, send_from_directory, request, url_for, Response, jsonify
+from flask import Flask, render_template, send_from_directory, request, url_for, Response, jsonify, make_response
 #from moviepy.editor import VideoFileClip
 from moviepy.video.io.VideoFileClip import VideoFileClip
-from ultralytics import YOLO
-from datetime import datetime
+from model_cache import ModelRegistry
+from storage import ArtifactStore, INPUT, INTERMEDIATE, OUTPUT
+from movement import MovementAnalyzer
+import rep_analysis
+from roi import RoiTracker
+from admission import AdmissionController, AdmissionRejected, estimate_cost, limit_threads
+from live_source import open_live_source, LatencyTracer
 
 app = Flask(__name__)
 
@@ -15,7 +21,14 @@ app.config.update(
     VIDEO_FOLDER='./videos',
     PROCESSED_FOLDER='./processed_videos',
     STATIC_FOLDER='./static',
-    MAX_CONTENT_LENGTH=16 * 1024 * 1024  # 16MB max file size
+    MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB max file size
+    STORAGE_BUDGET_BYTES=int(os.environ.get('STORAGE_BUDGET_BYTES', 2 * 1024 * 1024 * 1024)),  # 2GB across all artifacts
+    ROI_MODE=os.environ.get('ROI_MODE', '1') == '1',  # crop live frames around the lifter before inference
+    LIVE_RESERVE=float(os.environ.get('LIVE_RESERVE', 0.25)),  # share of cores kept for live sessions
+    LIVE_SESSION_CORES=float(os.environ.get('LIVE_SESSION_CORES', 1.0)),  # cores reserved per live session
+    INFERENCE_THREADS=int(os.environ['INFERENCE_THREADS']) if os.environ.get('INFERENCE_THREADS') else None,  # torch/OpenCV threads per job, uncapped by default
+    TARGET_LATENCY_SECONDS=float(os.environ.get('TARGET_LATENCY_SECONDS', 120)),  # max queued work per upload core
+    QUEUE_TIMEOUT_SECONDS=float(os.environ.get('QUEUE_TIMEOUT_SECONDS', 30))
 )
 
 # Ensure directories exist
@@ -33,153 +46,42 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Load YOLO models
-try:
-    yolo_models = {
-        'regular_deadlift': YOLO("models/best.pt"),
-        'sumo_deadlift': YOLO("models/sumo_best.pt"),
-        'squat': YOLO("models/squats_best.pt"),
-        'romanian_deadlift': YOLO("models/best_romanian.pt"),
-        "zercher_squat": YOLO("models/zercher_best.pt"),
-        "front_squat": YOLO("models/front_squats_best.pt")
-    }
-except Exception as e:
-    logger.error(f"Error loading YOLO models: {e}")
-    raise
-class MovementAnalyzer:
-    def __init__(self, exercise_type):
-        self.exercise_type = exercise_type
-        self.form_scores = []  # ibw for regular/squat, up for others
-        self.down_scores = []
-        self.rep_count = 0
-        
-        # Rep counting parameters
-        self.form_values = []  # Store recent form values for smoothing
-        self.window_size = 5   # Number of frames to use for smoothing
-        self.rep_threshold = 0.89  # Threshold for rep detection
-        self.min_frames_between_reps = 10  # Minimum frames between reps to prevent double counting
-        self.frames_since_last_rep = 0
-        self.in_rep_motion = False
-        self.rep_start_threshold = 0.85  # Start of rep threshold
-        self.rep_end_threshold = 0.92    # End of rep threshold
-        self.min_rep_frames = 5  # Minimum frames a rep motion should take
-        self.current_rep_frames = 0
-
-    def smooth_value(self, value):
-        """Apply moving average smoothing to reduce noise"""
-        self.form_values.append(value if value is not None else self.form_values[-1] if self.form_values else 0)
-        if len(self.form_values) > self.window_size:
-            self.form_values.pop(0)
-        return sum(self.form_values) / len(self.form_values)
-
-    def detect_rep(self, smoothed_value):
-        """Detect repetition using state machine approach"""
-        self.frames_since_last_rep += 1
-        
-        if smoothed_value is None:
-            return
-        
-        # Update rep detection state
-        if not self.in_rep_motion:
-            # Looking for the start of a rep
-            if (smoothed_value < self.rep_start_threshold and 
-                self.frames_since_last_rep > self.min_frames_between_reps):
-                self.in_rep_motion = True
-                self.current_rep_frames = 1
-        else:
-            # In the middle of a rep motion
-            self.current_rep_frames += 1
-            
-            # Check for rep completion
-            if (smoothed_value > self.rep_end_threshold and 
-                self.current_rep_frames >= self.min_rep_frames):
-                self.rep_count += 1
-                self.frames_since_last_rep = 0
-                self.in_rep_motion = False
-                self.current_rep_frames = 0
-            
-            # Reset if rep takes too long
-            elif self.current_rep_frames > self.min_frames_between_reps * 2:
-                self.in_rep_motion = False
-                self.current_rep_frames = 0
-
-    def process_frame(self, labels):
-        """Process a single frame's labels and update metrics"""
-        # Get appropriate form value based on exercise type
-        if self.exercise_type in ['regular_deadlift', 'squat']:
-            form_value = labels.get('ibw', None)
-        else:
-            form_value = labels.get('up', None)
-        
-        down_value = labels.get('down', None)
-
-        # Update scores
-        if form_value is not None:
-            self.form_scores.append(form_value)
-        if down_value is not None:
-            self.down_scores.append(down_value)
-
-        # Apply smoothing and detect reps
-        smoothed_value = self.smooth_value(form_value)
-        self.detect_rep(smoothed_value)
-        
-        return form_value, down_value
-
-    def get_metrics(self):
-        """Calculate and return movement metrics"""
-        if not self.form_scores or not self.down_scores:
-            return None
-
-        metrics = {
-            'frames_analyzed': len(self.form_scores),
-            'repetitions': self.rep_count,
-            'form_metrics': {
-                'average': np.mean(self.form_scores),
-                'min': min(self.form_scores),
-                'max': max(self.form_scores),
-                'consistency': 1 - (max(self.form_scores) - min(self.form_scores))
-            },
-            'depth_metrics': {
-                'average': np.mean(self.down_scores),
-                'min': min(self.down_scores),
-                'max': max(self.down_scores),
-                'consistency': 1 - (max(self.down_scores) - min(self.down_scores))
-            }
-        }
-
-        # Calculate overall score out of 10
-        form_component = metrics['form_metrics']['average'] * 0.6
-        depth_component = metrics['depth_metrics']['average'] * 0.4
-        overall_score = (form_component + depth_component) * 10
-
-        metrics['movement_assessment'] = {
-            'form_quality': self.get_quality_assessment(metrics['form_metrics']['average']),
-            'depth_quality': self.get_quality_assessment(metrics['depth_metrics']['average']),
-            'form_consistency': self.get_quality_assessment(metrics['form_metrics']['consistency']),
-            'depth_consistency': self.get_quality_assessment(metrics['depth_metrics']['consistency']),
-            'score': round(overall_score, 1)
-        }
-
-        return metrics
-
-    @staticmethod
-    def get_quality_assessment(value):
-        """Return a qualitative assessment based on the metric value"""
-        if value >= 0.9:
-            return "Excellent"
-        elif value >= 0.8:
-            return "Very Good"
-        elif value >= 0.7:
-            return "Good"
-        elif value >= 0.6:
-            return "Fair"
-        else:
-            return "Needs Improvement"
+# Track uploads and their derived videos so disk usage stays within budget
+artifact_store = ArtifactStore(app.config['STORAGE_BUDGET_BYTES'])
+artifact_store.scan(app.config['VIDEO_FOLDER'], INPUT)
+artifact_store.scan(app.config['PROCESSED_FOLDER'], INTERMEDIATE)
+artifact_store.scan(app.config['STATIC_FOLDER'], OUTPUT, prefix='web_', suffix='.mp4')
+
+# Limit concurrent processing so overload queues or rejects work instead of slowing everyone down
+admission = AdmissionController(
+    live_reserve=app.config['LIVE_RESERVE'],
+    live_session_cores=app.config['LIVE_SESSION_CORES'],
+    job_threads=app.config['INFERENCE_THREADS'],
+    target_latency=app.config['TARGET_LATENCY_SECONDS'],
+    queue_timeout=app.config['QUEUE_TIMEOUT_SECONDS']
+)
+# Capping threads keeps each job on the cores the controller budgets for it, so uploads
+# can't spill onto the live reserve; it applies process-wide, so it is opt-in
+if admission.job_threads:
+    limit_threads(admission.job_threads)
+
+# Latency reports of the most recent live sessions
+live_reports = deque(maxlen=20)
+
+# Load YOLO models from fused snapshots and warm them up in the background;
+# /ready reports when every model has been warmed
+yolo_models = ModelRegistry({
+    'regular_deadlift': "models/best.pt",
+    'sumo_deadlift': "models/sumo_best.pt",
+    'squat': "models/squats_best.pt",
+    'romanian_deadlift': "models/best_romanian.pt",
+    "zercher_squat": "models/zercher_best.pt",
+    "front_squat": "models/front_squats_best.pt"
+}).start()
 
 def process_video(video_path, output_path, exercise_type):
     """Process video with YOLO and movement analysis"""
     try:
-        analyzer = MovementAnalyzer(exercise_type)
         yolo_model = yolo_models[exercise_type]
         
         cap = cv2.VideoCapture(video_path)
@@ -198,10 +100,15 @@ def process_video(video_path, output_path, exercise_type):
             (frame_width, frame_height)
         )
 
+        # First pass: run inference and collect the per-frame timeseries
+        form_key = 'ibw' if exercise_type in ['regular_deadlift', 'squat'] else 'up'
+        form_values = []
+        down_values = []
+        keypoints_per_frame = []
+
         results = yolo_model(source=video_path, stream=True, conf=0.3)
         
         for result in results:
-            frame = result.orig_img
             labels = {}
             
             if result.boxes is not None:
@@ -211,22 +118,35 @@ def process_video(video_path, output_path, exercise_type):
                     label = result.names[class_id]
                     labels[label] = conf
 
-            # Process frame and get metrics
-            form_value, down_value = analyzer.process_frame(labels)
-            
-            # Draw keypoints if available
+            form_values.append(labels.get(form_key))
+            down_values.append(labels.get('down'))
+
             if hasattr(result, 'keypoints') and result.keypoints is not None:
-                keypoints = result.keypoints.xy[0]
-                for point in keypoints:
+                keypoints_per_frame.append(result.keypoints.xy[0].cpu().numpy())
+            else:
+                keypoints_per_frame.append(None)
+
+        # Analyze the whole clip at once instead of recomputing metrics on every frame
+        analysis = rep_analysis.analyze(form_values, down_values, exercise_type)
+
+        # Second pass: decode again and render the overlays
+        for frame_idx in range(len(form_values)):
+            success, frame = cap.read()
+            if not success:
+                break
+
+            # Draw keypoints if available
+            if keypoints_per_frame[frame_idx] is not None:
+                for point in keypoints_per_frame[frame_idx]:
                     x, y = int(point[0]), int(point[1])
                     cv2.circle(frame, (x, y), 5, (0, 255, 0), -1)
 
             # Add overlay information
-            metrics = analyzer.get_metrics()
-            if metrics:
-                cv2.putText(frame, f"Score: {metrics['movement_assessment']['score']}/10",
+            score = analysis['scores'][frame_idx]
+            if not np.isnan(score):
+                cv2.putText(frame, f"Score: {score}/10",
                           (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                cv2.putText(frame, f"Reps: {metrics['repetitions']}",
+                cv2.putText(frame, f"Reps: {analysis['rep_counts'][frame_idx]}",
                           (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
 
             out.write(frame)
@@ -234,12 +154,28 @@ def process_video(video_path, output_path, exercise_type):
         cap.release()
         out.release()
         
-        return analyzer.get_metrics()
+        return analysis['metrics']
 
     except Exception as e:
         logger.error(f"Error processing video: {e}")
         raise
 
+def lookup_processed(output_key):
+    """Return the pinned output for output_key, or None when it still has to be processed"""
+    output = artifact_store.lookup(OUTPUT, output_key, pin=True)
+    if output is not None and output.meta is None:
+        # Found on disk at startup, but its metrics were not kept
+        artifact_store.release(output.path)
+        return None
+    return output
+
+@app.after_request
+def track_output_access(response):
+    # Outputs are evicted least recently served first
+    if request.endpoint == 'static' and request.view_args:
+        artifact_store.touch(os.path.join(app.config['STATIC_FOLDER'], request.view_args['filename']))
+    return response
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -257,24 +193,52 @@ def index():
         if exercise_type not in yolo_models:
             return render_template('index.html', message='Invalid exercise type')
 
+        video_path = None
+        processed_path = None
+        output = None
         try:
-            # Generate unique filename
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{file.filename}"
-            video_path = os.path.join(app.config['VIDEO_FOLDER'], filename)
-            processed_path = os.path.join(app.config['PROCESSED_FOLDER'], f'processed_{filename}')
-            
-            file.save(video_path)
-            
-            # Process video and get metrics
-            metrics = process_video(video_path, processed_path, exercise_type)
-            
-            # Convert processed video to MP4 for web compatibility
-            clip = VideoFileClip(processed_path)
-            web_path = os.path.join(app.config['STATIC_FOLDER'], f'web_{filename}.mp4')
-            clip.write_videofile(web_path, codec='libx264')
-            
-            video_url = url_for('static', filename=f'web_{filename}.mp4')
+            # Name uploads by content hash so identical videos are stored and processed once
+            extension = os.path.splitext(file.filename)[1].lower()
+            video_path, digest = artifact_store.save_input(file, app.config['VIDEO_FOLDER'], extension)
+            output_key = f'{digest}_{exercise_type}'
+            filename = f'web_{output_key}.mp4'
+
+            output = lookup_processed(output_key)
+            if output is None:
+                # Identical uploads that arrive together are processed once; the others wait here
+                with artifact_store.producing(OUTPUT, output_key):
+                    output = lookup_processed(output_key)
+                    if output is None:
+                        # Estimate the cost from container metadata before decoding anything
+                        try:
+                            ticket = admission.admit_upload(estimate_cost(video_path, exercise_type))
+                        except AdmissionRejected as e:
+                            logger.warning(f"Rejected upload: {e}")
+                            response = make_response(render_template('index.html', message=str(e)), 429)
+                            response.headers['Retry-After'] = str(e.retry_after)
+                            return response
+
+                        with ticket:
+                            processed_path = os.path.join(app.config['PROCESSED_FOLDER'], f'processed_{output_key}.avi')
+                            artifact_store.register(processed_path, INTERMEDIATE, pin=True)
+
+                            # Process video and get metrics
+                            metrics = process_video(video_path, processed_path, exercise_type)
+                            artifact_store.register(processed_path, INTERMEDIATE)
+
+                            # Convert processed video to MP4 for web compatibility
+                            clip = VideoFileClip(processed_path)
+                            web_path = os.path.join(app.config['STATIC_FOLDER'], filename)
+                            try:
+                                clip.write_videofile(web_path, codec='libx264')
+                            finally:
+                                clip.close()
+                            # Pinned so enforcing the budget can't evict the video we are about to link
+                            output = artifact_store.register(web_path, OUTPUT, key=output_key, meta=metrics, pin=True)
+
+            metrics = output.meta
+            video_url = url_for('static', filename=filename)
+            yolo_models.mark_frame_served()
             
             return render_template('index.html',
                                 video_url=video_url,
@@ -285,6 +249,15 @@ def index():
             logger.error(f"Error processing upload: {e}")
             return render_template('index.html', message=f'Error processing video: {str(e)}')
 
+        finally:
+            # The XVID file is only needed until the web copy exists
+            if processed_path is not None:
+                artifact_store.release(processed_path)
+            if output is not None:
+                artifact_store.release(output.path)
+            if video_path is not None:
+                artifact_store.release(video_path)
+
     return render_template('index.html')
 
 @app.route('/live', methods=['POST'])
@@ -293,53 +266,81 @@ def live():
     if exercise_type not in yolo_models:
         return "Invalid exercise type", 400
 
+    # Live sessions run on their reserved share of the cores
+    try:
+        ticket = admission.admit_live()
+    except AdmissionRejected as e:
+        return str(e), 429, {'Retry-After': str(e.retry_after)}
+
     def generate_frames():
-        cap = cv2.VideoCapture(0)
+        # Webcam by default; LIVE_SOURCE can point at a video file to replay instead
+        cap = open_live_source()
+        tracer = LatencyTracer(cap)
         analyzer = MovementAnalyzer(exercise_type)
+        roi_tracker = RoiTracker(enabled=app.config['ROI_MODE'])
+        yolo_model = yolo_models[exercise_type]
         
         try:
             while True:
                 success, frame = cap.read()
                 if not success:
                     break
+                trace = tracer.start_frame()
 
-                results = yolo_models[exercise_type](source=frame, stream=True, conf=0.3)
-                
-                for result in results:
-                    frame = result.orig_img
-                    labels = {}
-                    
-                    if result.boxes is not None:
-                        for box in result.boxes:
-                            class_id = int(box.cls)
-                            conf = float(box.conf)
-                            label = result.names[class_id]
-                            labels[label] = conf
-
-                    form_value, down_value = analyzer.process_frame(labels)
-                    
-                    if hasattr(result, 'keypoints') and result.keypoints is not None:
-                        keypoints = result.keypoints.xy[0]
-                        for point in keypoints:
-                            x, y = int(point[0]), int(point[1])
-                            cv2.circle(frame, (x, y), 5, (0, 255, 0), -1)
-
-                    metrics = analyzer.get_metrics()
-                    if metrics:
-                        cv2.putText(frame, f"Score: {metrics['movement_assessment']['score']}/10",
-                                  (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-                        cv2.putText(frame, f"Reps: {metrics['repetitions']}",
-                                  (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                # Inference runs on a crop around the lifter; keypoints come back in frame coordinates
+                labels, keypoints = roi_tracker.detect(yolo_model, frame, conf=0.3)
+                trace.mark('inference')
+
+                form_value, down_value = analyzer.process_frame(labels)
+
+                if keypoints is not None:
+                    for point in keypoints:
+                        x, y = int(point[0]), int(point[1])
+                        cv2.circle(frame, (x, y), 5, (0, 255, 0), -1)
+
+                metrics = analyzer.get_metrics()
+                if metrics:
+                    cv2.putText(frame, f"Score: {metrics['movement_assessment']['score']}/10",
+                              (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                    cv2.putText(frame, f"Reps: {metrics['repetitions']}",
+                              (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                trace.mark('overlay')
 
                 ret, buffer = cv2.imencode('.jpg', frame)
                 frame = buffer.tobytes()
+                trace.mark('encode')
+                tracer.finish(trace)
+                yolo_models.mark_frame_served()
                 yield (b'--frame\r\n'
                        b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
         finally:
             cap.release()
-
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+            logger.debug(f"Live session sent {roi_tracker.pixel_ratio():.0%} of frame pixels to the model")
+            report = tracer.report()
+            live_reports.append(report)
+            logger.info(f"Live session latency: {report}")
+
+    response = Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.call_on_close(ticket.release)
+    return response
+
+@app.route('/live/report')
+def live_report():
+    return jsonify(list(live_reports))
+
+@app.route('/ready')
+def ready():
+    readiness = yolo_models.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
+@app.route('/storage/metrics')
+def storage_metrics():
+    return jsonify(artifact_store.metrics())
+
+@app.route('/admission/metrics')
+def admission_metrics():
+    return jsonify(admission.metrics())
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,177 @@
+import os
+import time
+import logging
+from collections import deque
+import numpy as np
+import cv2
+
+logger = logging.getLogger(__name__)
+
+# Where live frames come from: a webcam index ("0") or a video file to replay
+LIVE_SOURCE = os.environ.get('LIVE_SOURCE', '0')
+LIVE_SPEED = float(os.environ.get('LIVE_SPEED', 1.0))  # replay rate as a multiple of the file's fps
+LIVE_LOOP = os.environ.get('LIVE_LOOP', '0') == '1'
+
+
+class WebcamSource:
+    """cv2.VideoCapture on a camera, stamping each frame when it is read"""
+
+    def __init__(self, index=0):
+        self.cap = cv2.VideoCapture(index)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or None
+        self.target_fps = self.fps
+        self.frame_index = -1
+        self.capture_time = None
+        self.dropped = 0  # a camera doesn't tell us what it dropped
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        success, frame = self.cap.read()
+        if success:
+            self.frame_index += 1
+            self.capture_time = time.perf_counter()
+        return success, frame
+
+    def release(self):
+        self.cap.release()
+
+
+class FileReplaySource:
+    """Replays a video file as if it were a camera running at speed x the file's fps.
+
+    Frame i is due at start + i / (fps * speed) and is stamped with that time, so
+    latency includes any time the frame spent waiting for the pipeline. When the
+    pipeline falls behind, frames that a camera would already have replaced are
+    skipped and counted as dropped.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.target_fps = self.fps * speed
+        self.interval = 1.0 / self.target_fps
+        self.loop = loop
+        self.start = None
+        self.next_index = 0
+        self.frame_index = -1
+        self.capture_time = None
+        self.dropped = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+
+        # Skip the frames that were shown while we were busy, without decoding them
+        due = int((now - self.start) / self.interval)
+        while self.next_index < due:
+            if not self._advance(self.cap.grab):
+                return False, None
+            self.next_index += 1
+            self.dropped += 1
+
+        scheduled = self.start + self.next_index * self.interval
+        if scheduled > now:
+            time.sleep(scheduled - now)
+
+        success, frame = self._advance(self.cap.read)
+        if not success:
+            return False, None
+        self.frame_index = self.next_index
+        self.capture_time = scheduled
+        self.next_index += 1
+        return True, frame
+
+    def _advance(self, step):
+        result = step()
+        success = result[0] if isinstance(result, tuple) else result
+        if not success and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            result = step()
+        return result
+
+    def release(self):
+        self.cap.release()
+
+
+def open_live_source(spec=None, speed=None, loop=None):
+    """Open the configured live source; a digit selects a webcam, anything else is a file to replay"""
+    spec = LIVE_SOURCE if spec is None else str(spec)
+    if spec.isdigit():
+        return WebcamSource(int(spec))
+    return FileReplaySource(
+        spec,
+        speed=LIVE_SPEED if speed is None else speed,
+        loop=LIVE_LOOP if loop is None else loop
+    )
+
+
+class FrameTrace:
+    def __init__(self, index, captured_at):
+        self.index = index
+        self.captured_at = captured_at
+        self.stages = []  # (stage, perf_counter time) in pipeline order
+
+    def mark(self, stage):
+        self.stages.append((stage, time.perf_counter()))
+
+
+class LatencyTracer:
+    """Collects per-frame stage timestamps for a live session and summarizes them"""
+
+    def __init__(self, source, max_frames=10000):
+        self.source = source
+        self.traces = deque(maxlen=max_frames)
+        self.frames = 0
+        self.first_capture = None
+        self.last_done = None
+
+    def start_frame(self):
+        """Begin tracing the frame the source just returned; marks the capture stage"""
+        trace = FrameTrace(self.source.frame_index, self.source.capture_time)
+        trace.mark('capture')
+        if self.first_capture is None:
+            self.first_capture = trace.captured_at
+        return trace
+
+    def finish(self, trace):
+        self.traces.append(trace)
+        self.frames += 1
+        self.last_done = trace.stages[-1][1]
+
+    def report(self):
+        if not self.traces:
+            return {'frames': 0, 'dropped': self.source.dropped}
+
+        latencies = np.array([t.stages[-1][1] - t.captured_at for t in self.traces]) * 1000
+        stage_ms = {}
+        for trace in self.traces:
+            previous = trace.captured_at
+            for stage, stamp in trace.stages:
+                stage_ms.setdefault(stage, []).append((stamp - previous) * 1000)
+                previous = stamp
+
+        duration = self.last_done - self.first_capture
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        offered = self.frames + self.source.dropped
+        return {
+            'frames': self.frames,
+            'dropped': self.source.dropped,
+            'drop_rate': round(self.source.dropped / offered, 4),
+            'duration_seconds': round(duration, 3),
+            'achieved_fps': round(self.frames / duration, 2) if duration > 0 else None,
+            'target_fps': self.source.target_fps,
+            'latency_ms': {
+                'p50': round(float(p50), 1),
+                'p95': round(float(p95), 1),
+                'p99': round(float(p99), 1),
+                'max': round(float(latencies.max()), 1),
+            },
+            'stage_ms': {stage: round(float(np.mean(values)), 2) for stage, values in stage_ms.items()},
+        }
@@ -0,0 +1,394 @@
+"""Load test lication.py or onnxapp74.py on a single node.
+
+Starts the app in a subprocess with a deterministic stub detector (no weights or GPU
+needed), drives concurrent uploads, /live MJPEG viewers and result fetches against it,
+and reports throughput, latency percentiles, error rate and server CPU/RSS over time.
+
+    LIVE_SESSION_CORES=0.5 python loadtest.py --app lication --uploads 4 --live 2 --fetches 4 --duration 60
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import importlib
+import threading
+import subprocess
+import numpy as np
+import requests
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULT_URL = re.compile(r'Processed Video: (\S+?)</h2>')
+
+
+class _Array(np.ndarray):
+    """ndarray with the .cpu().numpy() calls the apps make on torch tensors"""
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return np.asarray(self)
+
+
+class _Box:
+    def __init__(self, cls, conf):
+        self.cls = cls
+        self.conf = conf
+
+
+class _Boxes(list):
+    def __init__(self, boxes, xyxy):
+        super().__init__(boxes)
+        self.xyxy = xyxy
+
+
+class _Keypoints:
+    def __init__(self, xy):
+        self.xy = xy
+
+
+class StubResult:
+    def __init__(self, orig_img, boxes, names, keypoints):
+        self.orig_img = orig_img
+        self.boxes = boxes
+        self.names = names
+        self.keypoints = keypoints
+
+
+class StubDetector:
+    """Stands in for a YOLO pose model.
+
+    Confidences and keypoints are derived from the frame's pixels, so the same video
+    always produces the same labels. Each call resizes the frame to the inference size
+    and then sleeps for latency_ms to stand in for the model's forward pass.
+    """
+
+    names = {0: 'ibw', 1: 'up', 2: 'down'}
+
+    def __init__(self, latency_ms=20.0):
+        self.latency_ms = latency_ms
+
+    def __call__(self, source=None, stream=False, conf=0.25, imgsz=640, verbose=True, **kwargs):
+        if isinstance(source, str):
+            results = self._stream_file(source, imgsz)
+        else:
+            results = iter([self._predict(source, imgsz)])
+        return results if stream else list(results)
+
+    def _stream_file(self, path, imgsz):
+        import cv2
+        cap = cv2.VideoCapture(path)
+        try:
+            while True:
+                success, frame = cap.read()
+                if not success:
+                    break
+                yield self._predict(frame, imgsz)
+        finally:
+            cap.release()
+
+    def _predict(self, frame, imgsz):
+        import cv2
+        height, width = frame.shape[:2]
+        scale = imgsz / max(height, width)
+        small = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))))
+        time.sleep(self.latency_ms / 1000)
+
+        # Brightness changes slowly between frames, which gives rep-like oscillations
+        phase = float(small.mean()) * 3.0
+        form = 0.88 + 0.08 * np.sin(phase)
+        down = 0.80 + 0.10 * np.cos(phase)
+
+        # The "lifter" fills the middle two thirds, so ROI crops with 25% padding stay stable
+        box = np.array([width / 6, height / 6, width * 5 / 6, height * 5 / 6], dtype=np.float32)
+        boxes = _Boxes([_Box(0, form), _Box(1, form), _Box(2, down)], np.tile(box, (3, 1)).view(_Array))
+        grid = np.linspace(0.2, 0.8, 17, dtype=np.float32)
+        keypoints = np.stack([width * (0.4 + 0.2 * grid), height * grid], axis=1)
+        keypoints[-1] = 0  # an undetected joint, reported at (0, 0) like the real model does
+        return StubResult(frame, boxes, self.names, _Keypoints(keypoints[None].view(_Array)))
+
+
+def serve(app_name, port, stub_latency_ms):
+    """Run the app in this process with stub models"""
+    import model_cache
+
+    stub = StubDetector(stub_latency_ms)
+    model_cache.load_model = lambda weights_path, snapshot_dir=None: (stub, 'stub')
+
+    module = importlib.import_module(app_name)
+    module.app.run(host='127.0.0.1', port=port, debug=False, threaded=True)
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}  # kind -> list of (finished_at, latency_seconds, ok)
+        self.live_frames = []  # (session, arrival_time)
+        self.result_urls = []
+
+    def record(self, kind, latency, ok):
+        with self.lock:
+            self.samples.setdefault(kind, []).append((time.time(), latency, ok))
+
+
+def upload_worker(base_url, recorder, stop, video_bytes, exercise_type, unique):
+    while not stop.is_set():
+        payload = video_bytes
+        if unique:
+            # Trailing bytes change the content hash so deduplication doesn't serve a cached result
+            payload = video_bytes + os.urandom(16)
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = requests.post(
+                f'{base_url}/',
+                files={'video': ('loadtest.mp4', payload, 'video/mp4')},
+                data={'exercise_type': exercise_type},
+                timeout=600
+            )
+            if response.status_code == 429:
+                # Admission control turned the upload away; back off as asked
+                recorder.record('upload_429', time.perf_counter() - start, True)
+                stop.wait(min(float(response.headers.get('Retry-After', 1)), 5))
+                continue
+            match = RESULT_URL.search(response.text)
+            ok = response.ok and match is not None
+            if match:
+                with recorder.lock:
+                    recorder.result_urls.append(match.group(1))
+        except requests.RequestException:
+            pass
+        recorder.record('upload', time.perf_counter() - start, ok)
+
+
+def live_worker(base_url, recorder, stop, exercise_type, session):
+    boundary = b'--frame'
+    while not stop.is_set():
+        start = time.perf_counter()
+        ok = False
+        try:
+            with requests.post(f'{base_url}/live', data={'live_exercise_type': exercise_type},
+                               stream=True, timeout=60) as response:
+                if response.status_code == 429:
+                    recorder.record('live_429', time.perf_counter() - start, True)
+                    stop.wait(min(float(response.headers.get('Retry-After', 1)), 5))
+                    continue
+                if response.ok:
+                    buffered = b''
+                    last = start
+                    for chunk in response.iter_content(chunk_size=16384):
+                        buffered += chunk
+                        frames = buffered.count(boundary)
+                        if frames:
+                            buffered = buffered[buffered.rfind(boundary) + len(boundary):]
+                            now = time.perf_counter()
+                            for _ in range(frames):
+                                recorder.record('live_frame', now - last, True)
+                                with recorder.lock:
+                                    recorder.live_frames.append((session, time.time()))
+                            last = now
+                            ok = True
+                        if stop.is_set():
+                            break
+        except requests.RequestException:
+            pass
+        if not ok:
+            recorder.record('live_frame', time.perf_counter() - start, False)
+            time.sleep(1)
+
+
+def fetch_worker(base_url, recorder, stop):
+    while not stop.is_set():
+        with recorder.lock:
+            urls = list(recorder.result_urls)
+        if not urls:
+            time.sleep(0.5)
+            continue
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = requests.get(f'{base_url}{random.choice(urls)}', timeout=60)
+            ok = response.ok
+        except requests.RequestException:
+            pass
+        recorder.record('fetch', time.perf_counter() - start, ok)
+
+
+def sample_resources(pid, stop, interval, timeline):
+    if psutil is None:
+        return
+    process = psutil.Process(pid)
+    start = time.time()
+    process.cpu_percent(None)
+    while not stop.wait(interval):
+        try:
+            timeline.append({
+                't': round(time.time() - start, 1),
+                'cpu_percent': process.cpu_percent(None),
+                'rss_mb': round(process.memory_info().rss / 1024 / 1024, 1),
+                'threads': process.num_threads(),
+            })
+        except psutil.NoSuchProcess:
+            return
+
+
+def wait_until_ready(base_url, server, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if requests.get(f'{base_url}/ready', timeout=2).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("Server did not become ready")
+
+
+def summarize(recorder, duration, timeline):
+    report = {'duration_seconds': duration, 'requests': {}, 'resources': timeline}
+    for kind, samples in recorder.samples.items():
+        latencies = np.array([latency for _, latency, ok in samples if ok])
+        errors = sum(1 for _, _, ok in samples if not ok)
+        stats = {
+            'count': len(samples),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 4),
+            'throughput_per_second': round((len(samples) - errors) / duration, 3),
+        }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            stats.update({
+                'p50_ms': round(p50 * 1000, 1),
+                'p95_ms': round(p95 * 1000, 1),
+                'p99_ms': round(p99 * 1000, 1),
+                'max_ms': round(latencies.max() * 1000, 1),
+            })
+        report['requests'][kind] = stats
+    if recorder.live_frames:
+        sessions = {session for session, _ in recorder.live_frames}
+        report['live'] = {
+            'sessions': len(sessions),
+            'frames': len(recorder.live_frames),
+            'fps_per_session': round(len(recorder.live_frames) / duration / len(sessions), 2),
+        }
+    if timeline:
+        report['peak_cpu_percent'] = max(s['cpu_percent'] for s in timeline)
+        report['peak_rss_mb'] = max(s['rss_mb'] for s in timeline)
+    return report
+
+
+def print_report(report):
+    print(f"\nDuration: {report['duration_seconds']:.1f}s")
+    print(f"{'kind':<12}{'count':>8}{'errors':>8}{'rate/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind, stats in report['requests'].items():
+        print(f"{kind:<12}{stats['count']:>8}{stats['errors']:>8}{stats['throughput_per_second']:>9}"
+              f"{stats.get('p50_ms', '-'):>10}{stats.get('p95_ms', '-'):>10}{stats.get('p99_ms', '-'):>10}")
+    if 'live' in report:
+        live = report['live']
+        print(f"\nLive: {live['sessions']} sessions, {live['frames']} frames, {live['fps_per_session']} fps per session")
+    for session in report.get('live_sessions', []):
+        if session.get('frames'):
+            latency = session['latency_ms']
+            print(f"  session: {session['frames']} frames at {session['achieved_fps']} fps "
+                  f"(target {session['target_fps']}), {session['dropped']} dropped, "
+                  f"latency p50 {latency['p50']} / p95 {latency['p95']} / p99 {latency['p99']} ms")
+    if report['resources']:
+        print(f"\nServer peak CPU {report['peak_cpu_percent']}%, peak RSS {report['peak_rss_mb']} MB")
+        for sample in report['resources']:
+            print(f"  t={sample['t']:>6}s  cpu={sample['cpu_percent']:>6}%  rss={sample['rss_mb']:>8} MB  threads={sample['threads']}")
+
+
+def run(args):
+    base_url = f'http://127.0.0.1:{args.port}'
+    # /live replays the video in a loop at its native frame rate instead of opening a webcam
+    env = dict(os.environ, LIVE_SOURCE=os.path.abspath(args.video), LIVE_LOOP='1', LIVE_SPEED=str(args.live_speed))
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--app', args.app, '--port', str(args.port),
+         '--stub-latency-ms', str(args.stub_latency_ms)],
+        cwd=ROOT,
+        env=env
+    )
+    try:
+        wait_until_ready(base_url, server, args.startup_timeout)
+
+        with open(args.video, 'rb') as f:
+            video_bytes = f.read()
+
+        recorder = Recorder()
+        stop = threading.Event()
+        timeline = []
+        threads = [threading.Thread(target=sample_resources, args=(server.pid, stop, args.sample_interval, timeline))]
+        for _ in range(args.uploads):
+            threads.append(threading.Thread(target=upload_worker,
+                                            args=(base_url, recorder, stop, video_bytes, args.exercise_type, args.unique)))
+        for session in range(args.live):
+            threads.append(threading.Thread(target=live_worker, args=(base_url, recorder, stop, args.exercise_type, session)))
+        for _ in range(args.fetches):
+            threads.append(threading.Thread(target=fetch_worker, args=(base_url, recorder, stop)))
+
+        start = time.time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        duration = time.time() - start
+
+        report = summarize(recorder, duration, timeline)
+        if args.live:
+            # Give the server a moment to close the streams and record their latency reports
+            time.sleep(2)
+            try:
+                report['live_sessions'] = requests.get(f'{base_url}/live/report', timeout=10).json()
+            except (requests.RequestException, ValueError):
+                report['live_sessions'] = []
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', nargs='?', default='run', choices=['run', 'serve'])
+    parser.add_argument('--app', default='lication', choices=['lication', 'onnxapp74'])
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--video', default=os.path.join(ROOT, 'static', 'processed_test.mp4'))
+    parser.add_argument('--exercise-type', default='squat')
+    parser.add_argument('--uploads', type=int, default=2, help='concurrent upload clients')
+    parser.add_argument('--live', type=int, default=1, help='concurrent /live viewers')
+    parser.add_argument('--fetches', type=int, default=2, help='concurrent result fetchers')
+    parser.add_argument('--duration', type=float, default=60, help='seconds of load')
+    parser.add_argument('--unique', action='store_true', help='make every upload unique to bypass deduplication')
+    parser.add_argument('--live-speed', type=float, default=1.0, help='replay rate for /live as a multiple of the video fps')
+    parser.add_argument('--stub-latency-ms', type=float, default=20.0, help='simulated inference time per frame')
+    parser.add_argument('--sample-interval', type=float, default=1.0, help='seconds between CPU/RSS samples')
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        serve(args.app, args.port, args.stub_latency_ms)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from copy import deepcopy
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+try:
+    import psutil
+    PROCESS_START = psutil.Process().create_time()
+except ImportError:
+    PROCESS_START = time.time()
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get('MODEL_SNAPSHOT_DIR', './model_snapshots')
+WARMUP_RUNS = int(os.environ.get('WARMUP_RUNS', 2))
+WARMUP_IMGSZ = int(os.environ.get('WARMUP_IMGSZ', 640))
+
+
+def weight_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_path(weights_path, snapshot_dir=SNAPSHOT_DIR):
+    """Snapshots are keyed by weight hash, so retrained weights never reuse a stale snapshot"""
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    return os.path.join(snapshot_dir, f'{stem}_{weight_hash(weights_path)[:16]}_fused.pt')
+
+
+def write_snapshot(model, path):
+    """Save the model with Conv+BN already fused, in the checkpoint layout YOLO() loads"""
+    model.fuse()
+    ckpt = {
+        'model': deepcopy(model.model),
+        'train_args': (model.ckpt or {}).get('train_args', {'task': model.task}),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so concurrent workers never load a half-written file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    torch.save(ckpt, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_model(weights_path, snapshot_dir=SNAPSHOT_DIR):
+    """Load a YOLO model from its fused snapshot, creating the snapshot on first use"""
+    path = snapshot_path(weights_path, snapshot_dir)
+    if os.path.exists(path):
+        try:
+            return YOLO(path), 'snapshot'
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+
+    model = YOLO(weights_path)
+    try:
+        write_snapshot(model, path)
+    except Exception as e:
+        logger.warning(f"Could not write snapshot for {weights_path}: {e}")
+    return model, 'weights'
+
+
+def warm_up(model, runs=WARMUP_RUNS, imgsz=WARMUP_IMGSZ):
+    """Run inference on blank frames so predictor setup and kernel initialisation happen now"""
+    frame = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    for _ in range(runs):
+        model(source=frame, conf=0.3, imgsz=imgsz, verbose=False)
+
+
+class ModelRegistry:
+    """Loads and warms up the exercise models in the background and reports readiness.
+
+    Behaves like the dict of models it replaces: `name in registry` checks the configured
+    names and `registry[name]` waits until that model is warm.
+    """
+
+    def __init__(self, model_paths, snapshot_dir=SNAPSHOT_DIR, warmup_runs=WARMUP_RUNS, warmup_imgsz=WARMUP_IMGSZ):
+        self.model_paths = model_paths
+        self.snapshot_dir = snapshot_dir
+        self.warmup_runs = warmup_runs
+        self.warmup_imgsz = warmup_imgsz
+        self.models = {}
+        self.status = {
+            name: {'state': 'pending', 'source': None, 'load_seconds': None, 'warmup_seconds': None, 'error': None}
+            for name in model_paths
+        }
+        self.events = {name: threading.Event() for name in model_paths}
+        self.first_frame_seconds = None
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self, background=True):
+        if background:
+            self.thread = threading.Thread(target=self.load_all, daemon=True)
+            self.thread.start()
+        else:
+            self.load_all()
+        return self
+
+    def load_all(self):
+        for name, weights_path in self.model_paths.items():
+            status = self.status[name]
+            try:
+                status['state'] = 'loading'
+                start = time.perf_counter()
+                model, status['source'] = load_model(weights_path, self.snapshot_dir)
+                status['load_seconds'] = round(time.perf_counter() - start, 3)
+
+                status['state'] = 'warming'
+                start = time.perf_counter()
+                warm_up(model, self.warmup_runs, self.warmup_imgsz)
+                status['warmup_seconds'] = round(time.perf_counter() - start, 3)
+
+                self.models[name] = model
+                status['state'] = 'warm'
+                logger.info(f"Model {name} warm from {status['source']} "
+                            f"(load {status['load_seconds']}s, warm-up {status['warmup_seconds']}s)")
+            except Exception as e:
+                status['state'] = 'failed'
+                status['error'] = str(e)
+                logger.error(f"Error loading YOLO model {name}: {e}")
+            finally:
+                self.events[name].set()
+
+    def __contains__(self, name):
+        return name in self.model_paths
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def keys(self):
+        return self.model_paths.keys()
+
+    def get(self, name, timeout=None):
+        if not self.events[name].wait(timeout):
+            raise TimeoutError(f"Model {name} is still loading")
+        if name not in self.models:
+            raise RuntimeError(f"Model {name} failed to load: {self.status[name]['error']}")
+        return self.models[name]
+
+    def is_ready(self):
+        return all(status['state'] == 'warm' for status in self.status.values())
+
+    def mark_frame_served(self):
+        """Record the time from process start to the first frame sent to a client"""
+        with self.lock:
+            if self.first_frame_seconds is None:
+                self.first_frame_seconds = round(time.time() - PROCESS_START, 3)
+                logger.info(f"First frame served {self.first_frame_seconds}s after process start")
+
+    def readiness(self):
+        return {
+            'ready': self.is_ready(),
+            'uptime_seconds': round(time.time() - PROCESS_START, 3),
+            'first_frame_seconds': self.first_frame_seconds,
+            'models': self.status,
+        }
@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class MovementAnalyzer:
+    def __init__(self, exercise_type):
+        self.exercise_type = exercise_type
+        self.form_scores = []  # ibw for regular/squat, up for others
+        self.down_scores = []
+        self.rep_count = 0
+        
+        # Rep counting parameters
+        self.form_values = []  # Store recent form values for smoothing
+        self.window_size = 5   # Number of frames to use for smoothing
+        self.rep_threshold = 0.89  # Threshold for rep detection
+        self.min_frames_between_reps = 10  # Minimum frames between reps to prevent double counting
+        self.frames_since_last_rep = 0
+        self.in_rep_motion = False
+        self.rep_start_threshold = 0.85  # Start of rep threshold
+        self.rep_end_threshold = 0.92    # End of rep threshold
+        self.min_rep_frames = 5  # Minimum frames a rep motion should take
+        self.current_rep_frames = 0
+
+    def smooth_value(self, value):
+        """Apply moving average smoothing to reduce noise"""
+        self.form_values.append(value if value is not None else self.form_values[-1] if self.form_values else 0)
+        if len(self.form_values) > self.window_size:
+            self.form_values.pop(0)
+        return sum(self.form_values) / len(self.form_values)
+
+    def detect_rep(self, smoothed_value):
+        """Detect repetition using state machine approach"""
+        self.frames_since_last_rep += 1
+        
+        if smoothed_value is None:
+            return
+        
+        # Update rep detection state
+        if not self.in_rep_motion:
+            # Looking for the start of a rep
+            if (smoothed_value < self.rep_start_threshold and 
+                self.frames_since_last_rep > self.min_frames_between_reps):
+                self.in_rep_motion = True
+                self.current_rep_frames = 1
+        else:
+            # In the middle of a rep motion
+            self.current_rep_frames += 1
+            
+            # Check for rep completion
+            if (smoothed_value > self.rep_end_threshold and 
+                self.current_rep_frames >= self.min_rep_frames):
+                self.rep_count += 1
+                self.frames_since_last_rep = 0
+                self.in_rep_motion = False
+                self.current_rep_frames = 0
+            
+            # Reset if rep takes too long
+            elif self.current_rep_frames > self.min_frames_between_reps * 2:
+                self.in_rep_motion = False
+                self.current_rep_frames = 0
+
+    def process_frame(self, labels):
+        """Process a single frame's labels and update metrics"""
+        # Get appropriate form value based on exercise type
+        if self.exercise_type in ['regular_deadlift', 'squat']:
+            form_value = labels.get('ibw', None)
+        else:
+            form_value = labels.get('up', None)
+        
+        down_value = labels.get('down', None)
+
+        # Update scores
+        if form_value is not None:
+            self.form_scores.append(form_value)
+        if down_value is not None:
+            self.down_scores.append(down_value)
+
+        # Apply smoothing and detect reps
+        smoothed_value = self.smooth_value(form_value)
+        self.detect_rep(smoothed_value)
+        
+        return form_value, down_value
+
+    def get_metrics(self):
+        """Calculate and return movement metrics"""
+        if not self.form_scores or not self.down_scores:
+            return None
+
+        metrics = {
+            'frames_analyzed': len(self.form_scores),
+            'repetitions': self.rep_count,
+            'form_metrics': {
+                'average': np.mean(self.form_scores),
+                'min': min(self.form_scores),
+                'max': max(self.form_scores),
+                'consistency': 1 - (max(self.form_scores) - min(self.form_scores))
+            },
+            'depth_metrics': {
+                'average': np.mean(self.down_scores),
+                'min': min(self.down_scores),
+                'max': max(self.down_scores),
+                'consistency': 1 - (max(self.down_scores) - min(self.down_scores))
+            }
+        }
+
+        # Calculate overall score out of 10
+        form_component = metrics['form_metrics']['average'] * 0.6
+        depth_component = metrics['depth_metrics']['average'] * 0.4
+        overall_score = (form_component + depth_component) * 10
+
+        metrics['movement_assessment'] = {
+            'form_quality': self.get_quality_assessment(metrics['form_metrics']['average']),
+            'depth_quality': self.get_quality_assessment(metrics['depth_metrics']['average']),
+            'form_consistency': self.get_quality_assessment(metrics['form_metrics']['consistency']),
+            'depth_consistency': self.get_quality_assessment(metrics['depth_metrics']['consistency']),
+            'score': round(overall_score, 1)
+        }
+
+        return metrics
+
+    @staticmethod
+    def get_quality_assessment(value):
+        """Return a qualitative assessment based on the metric value"""
+        if value >= 0.9:
+            return "Excellent"
+        elif value >= 0.8:
+            return "Very Good"
+        elif value >= 0.7:
+            return "Good"
+        elif value >= 0.6:
+            return "Fair"
+        else:
+            return "Needs Improvement"
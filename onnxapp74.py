@@ -1,10 +1,16 @@
 import os
 import logging
-from flask import Flask, render_template, send_from_directory, request, url_for, Response
+from collections import deque
+from flask import Flask, render_template, send_from_directory, request, url_for, Response, jsonify, make_response
 import cv2
 from moviepy.editor import VideoFileClip
-from ultralytics import YOLO
+from model_cache import ModelRegistry
+from storage import ArtifactStore, INPUT, INTERMEDIATE, OUTPUT
 from flask_cors import CORS, cross_origin
+import rep_analysis
+from roi import RoiTracker
+from admission import AdmissionController, AdmissionRejected, estimate_cost, limit_threads
+from live_source import open_live_source, LatencyTracer
 
 app = Flask(__name__)
 
@@ -15,6 +21,22 @@ VIDEO_FOLDER = './videos'
 PROCESSED_FOLDER = './processed_videos'
 STATIC_FOLDER = './static'
 
+# Crop live frames around the lifter before inference
+ROI_MODE = os.environ.get('ROI_MODE', '1') == '1'
+
+# Limit concurrent processing so overload queues or rejects work instead of slowing everyone down
+admission = AdmissionController(
+    live_reserve=float(os.environ.get('LIVE_RESERVE', 0.25)),
+    live_session_cores=float(os.environ.get('LIVE_SESSION_CORES', 1.0)),
+    job_threads=int(os.environ['INFERENCE_THREADS']) if os.environ.get('INFERENCE_THREADS') else None,
+    target_latency=float(os.environ.get('TARGET_LATENCY_SECONDS', 120)),
+    queue_timeout=float(os.environ.get('QUEUE_TIMEOUT_SECONDS', 30))
+)
+# Capping threads keeps each job on the cores the controller budgets for it, so uploads
+# can't spill onto the live reserve; it applies process-wide, so it is opt-in
+if admission.job_threads:
+    limit_threads(admission.job_threads)
+
 app.config['VIDEO_FOLDER'] = VIDEO_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 app.config['STATIC_FOLDER'] = STATIC_FOLDER
@@ -27,15 +49,21 @@ os.makedirs(app.config['STATIC_FOLDER'], exist_ok=True)
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
-# Load the YOLO models
-yolo_models = {
-    'regular_deadlift': YOLO("muscleAi_weights/best.pt"),
-    'sumo_deadlift': YOLO("muscleAi_weights/sumo_best.pt"),
-    'squat': YOLO("muscleAi_weights/squats_best.pt"),
-    'romanian_deadlift': YOLO("muscleAi_weights/best_romanian.pt"),
-    "zercher_squat": YOLO("muscleAi_weights/zercher_best.pt"),
-    "front_squat": YOLO("muscleAi_weights/front_squats_best.pt")
-}
+# Track uploads and their derived videos so disk usage stays within budget
+artifact_store = ArtifactStore(int(os.environ.get('STORAGE_BUDGET_BYTES', 2 * 1024 * 1024 * 1024)))
+artifact_store.scan(app.config['VIDEO_FOLDER'], INPUT)
+artifact_store.scan(app.config['PROCESSED_FOLDER'], INTERMEDIATE)
+artifact_store.scan(app.config['STATIC_FOLDER'], OUTPUT, prefix='web_', suffix='.mp4')
+
+# Load the YOLO models from fused snapshots and warm them up in the background
+yolo_models = ModelRegistry({
+    'regular_deadlift': "muscleAi_weights/best.pt",
+    'sumo_deadlift': "muscleAi_weights/sumo_best.pt",
+    'squat': "muscleAi_weights/squats_best.pt",
+    'romanian_deadlift': "muscleAi_weights/best_romanian.pt",
+    "zercher_squat": "muscleAi_weights/zercher_best.pt",
+    "front_squat": "muscleAi_weights/front_squats_best.pt"
+}).start()
 
 # Function to check for injury risk
 def check_injury_risk(labels, exercise_type):
@@ -63,9 +91,6 @@ def draw_keypoints(frame, keypoints):
 def process_video_with_yolo(video_path, output_path, exercise_type):
     try:
         yolo_model = yolo_models[exercise_type]
-        last_ibw_label = None
-        rep_count = 0
-        rep_started = False
 
         cap = cv2.VideoCapture(video_path)
         if not cap.isOpened():
@@ -76,11 +101,15 @@ def process_video_with_yolo(video_path, output_path, exercise_type):
         fps = cap.get(cv2.CAP_PROP_FPS)
         out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'XVID'), fps, (frame_width, frame_height))
 
-        results = yolo_model(source=video_path, stream=True, conf=0.3)
+        # First pass: run inference and collect the per-frame timeseries
+        form_key = 'ibw' if exercise_type in ['regular_deadlift', 'squat'] else 'up'
+        ibw_values = []
+        injury_risks = []
+        keypoints_per_frame = []
 
-        for frame_idx, result in enumerate(results):
-            frame = result.orig_img
+        results = yolo_model(source=video_path, stream=True, conf=0.3)
 
+        for result in results:
             labels = {}
             if result.boxes is not None:
                 for box in result.boxes:
@@ -89,33 +118,30 @@ def process_video_with_yolo(video_path, output_path, exercise_type):
                     label = result.names[class_id]
                     labels[label] = conf
 
-            injury_risk = check_injury_risk(labels, exercise_type)
-
-            if exercise_type in ['regular_deadlift', 'squat']:
-                current_ibw_label = labels.get('ibw')
-                current_down_label = labels.get('down')
-            elif exercise_type in ['sumo_deadlift', 'romanian_deadlift', 'zercher_squat', 'front_squat']:
-                current_ibw_label = labels.get('up')
-                current_down_label = labels.get('down')
+            injury_risks.append(check_injury_risk(labels, exercise_type))
+            ibw_values.append(labels.get(form_key))
 
-            if last_ibw_label is not None and current_ibw_label is not None:
-                if not rep_started:
-                    if last_ibw_label > 0.89 and current_ibw_label <= 0.89:
-                        rep_started = True
-                else:
-                    if last_ibw_label <= 0.89 and current_ibw_label > 0.89:
-                        rep_count += 1
-                        rep_started = False
-
-            last_ibw_label = current_ibw_label
+            if hasattr(result, 'keypoints') and result.keypoints is not None:
+                keypoints_per_frame.append(result.keypoints.xy[0].cpu().numpy())  # Keypoints for the first detected person
+            else:
+                keypoints_per_frame.append(None)
+
+        # Count reps over the whole clip at once instead of stepping a state machine per frame
+        rep_frames = rep_analysis.crossing_rep_frames(rep_analysis.to_series(ibw_values))
+        rep_counts = rep_analysis.running_counts(rep_frames, len(ibw_values))
+
+        # Second pass: decode again and render the overlays
+        for frame_idx in range(len(ibw_values)):
+            success, frame = cap.read()
+            if not success:
+                break
 
             # Draw keypoints on the frame if available
-            if hasattr(result, 'keypoints') and result.keypoints is not None:
-                keypoints = result.keypoints.xy[0]  # Get keypoints for the first detected person
-                frame = draw_keypoints(frame, keypoints)
+            if keypoints_per_frame[frame_idx] is not None:
+                frame = draw_keypoints(frame, keypoints_per_frame[frame_idx])
 
-            cv2.putText(frame, f"Injury Risk: {injury_risk}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv2.LINE_AA)
-            cv2.putText(frame, f"Repetitions: {rep_count}", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+            cv2.putText(frame, f"Injury Risk: {injury_risks[frame_idx]}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv2.LINE_AA)
+            cv2.putText(frame, f"Repetitions: {rep_counts[frame_idx]}", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
             out.write(frame)
 
@@ -125,6 +151,9 @@ def process_video_with_yolo(video_path, output_path, exercise_type):
         logging.error(f"Error processing video: {e}")
         raise
 
+# Latency reports of the most recent live sessions
+live_reports = deque(maxlen=20)
+
 # Global variables for live video processing
 last_ibw_label = None
 rep_count = 0
@@ -136,30 +165,27 @@ def process_live_video(exercise_type):
     
     yolo_model = yolo_models[exercise_type]
 
-    cap = cv2.VideoCapture(0)
+    # Webcam by default; LIVE_SOURCE can point at a video file to replay instead
+    cap = open_live_source()
     if not cap.isOpened():
-        raise IOError("Error opening webcam")
+        raise IOError("Error opening live source")
+    tracer = LatencyTracer(cap)
+
+    roi_tracker = RoiTracker(enabled=ROI_MODE)
 
     def generate_frames():
         global last_ibw_label, rep_count, rep_started
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                trace = tracer.start_frame()
 
-            results = yolo_model(source=frame, stream=True, conf=0.3)
-
-            for result in results:
-                frame = result.orig_img
-
-                labels = {}
-                if result.boxes is not None:
-                    for box in result.boxes:
-                        class_id = int(box.cls)
-                        conf = float(box.conf)
-                        label = result.names[class_id]
-                        labels[label] = conf
+                # Inference runs on a crop around the lifter; keypoints come back in frame coordinates
+                labels, keypoints = roi_tracker.detect(yolo_model, frame, conf=0.3)
+                trace.mark('inference')
 
                 injury_risk = check_injury_risk(labels, exercise_type)
 
@@ -182,14 +208,17 @@ def process_live_video(exercise_type):
                 last_ibw_label = current_ibw_label
 
                 # Draw keypoints on the frame if available
-                if hasattr(result, 'keypoints') and result.keypoints is not None:
-                    keypoints = result.keypoints.xy[0]  # Get keypoints for the first detected person
+                if keypoints is not None:
                     frame = draw_keypoints(frame, keypoints)
 
                 cv2.putText(frame, f"Injury Risk: {injury_risk}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2, cv2.LINE_AA)
+                trace.mark('overlay')
 
                 ret, buffer = cv2.imencode('.jpg', frame)
                 frame = buffer.tobytes()
+                trace.mark('encode')
+                tracer.finish(trace)
+                yolo_models.mark_frame_served()
 
                 # Yielding the frame with CORS headers
                 yield (b'--frame\r\n'
@@ -197,18 +226,36 @@ def process_live_video(exercise_type):
                        b'Access-Control-Allow-Origin: http://localhost:3000\r\n'
                        b'Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n'
                        b'Access-Control-Allow-Headers: Content-Type\r\n\r\n' + frame + b'\r\n')
+        finally:
+            cap.release()
+            report = tracer.report()
+            live_reports.append(report)
+            logging.info(f"Live session latency: {report}")
 
     return Response(
         generate_frames(),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
 
+@app.route('/live/report', methods=['GET'])
+@cross_origin(origin='*')
+def live_report():
+    return jsonify(list(live_reports))
+
+@app.route('/ready', methods=['GET'])
+@cross_origin(origin='*')
+def ready():
+    readiness = yolo_models.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
 @app.route('/<filename>', methods=['GET'])
 @cross_origin(origin='*')
 def serve_video(filename):
     try:
         logging.debug(f"Serving video: {filename}")
-        return send_from_directory(app.config['PROCESSED_FOLDER'], filename)
+        # Outputs are evicted least recently served first
+        artifact_store.touch(os.path.join(app.config['STATIC_FOLDER'], filename))
+        return send_from_directory(app.config['STATIC_FOLDER'], filename)
     except Exception as e:
         logging.error(f"Error serving video: {e}")
         return "Error serving video", 500
@@ -224,23 +271,65 @@ def index():
 
             exercise_type = request.form.get('exercise_type')  # Added a form field for selecting the exercise type
 
-            video_path = os.path.join(app.config['VIDEO_FOLDER'], file.filename)
-            file.save(video_path)
+            if exercise_type not in yolo_models:
+                return render_template('index.html', message='Invalid exercise type')
 
+            video_path = None
+            processed_path = None
+            output = None
             try:
-                processed_video_path = os.path.join(app.config['PROCESSED_FOLDER'], f'processed_{file.filename}')
-                static_video_path = os.path.join(app.config['STATIC_FOLDER'], f'processed_{file.filename}')
-                process_video_with_yolo(video_path, processed_video_path, exercise_type)
-
-                clip = VideoFileClip(processed_video_path)
-                clip.write_videofile(static_video_path, codec='libx264')
-
-                video_url = url_for('serve_video', filename=f'processed_{file.filename}')
+                # Name uploads by content hash so identical videos are stored and processed once
+                extension = os.path.splitext(file.filename)[1].lower()
+                video_path, digest = artifact_store.save_input(file, app.config['VIDEO_FOLDER'], extension)
+                output_key = f'{digest}_{exercise_type}'
+                filename = f'web_{output_key}.mp4'
+
+                output = artifact_store.lookup(OUTPUT, output_key, pin=True)
+                if output is None:
+                    # Identical uploads that arrive together are processed once; the others wait here
+                    with artifact_store.producing(OUTPUT, output_key):
+                        output = artifact_store.lookup(OUTPUT, output_key, pin=True)
+                        if output is None:
+                            # Estimate the cost from container metadata before decoding anything
+                            try:
+                                ticket = admission.admit_upload(estimate_cost(video_path, exercise_type))
+                            except AdmissionRejected as e:
+                                logging.warning(f"Rejected upload: {e}")
+                                response = make_response(render_template('index.html', message=str(e)), 429)
+                                response.headers['Retry-After'] = str(e.retry_after)
+                                return response
+
+                            with ticket:
+                                processed_path = os.path.join(app.config['PROCESSED_FOLDER'], f'processed_{output_key}.avi')
+                                artifact_store.register(processed_path, INTERMEDIATE, pin=True)
+                                process_video_with_yolo(video_path, processed_path, exercise_type)
+                                artifact_store.register(processed_path, INTERMEDIATE)
+
+                                clip = VideoFileClip(processed_path)
+                                static_video_path = os.path.join(app.config['STATIC_FOLDER'], filename)
+                                try:
+                                    clip.write_videofile(static_video_path, codec='libx264')
+                                finally:
+                                    clip.close()
+                                # Pinned so enforcing the budget can't evict the video we are about to link
+                                output = artifact_store.register(static_video_path, OUTPUT, key=output_key, pin=True)
+
+                video_url = url_for('serve_video', filename=filename)
+                yolo_models.mark_frame_served()
                 return render_template('index.html', video_url=video_url)
 
             except Exception as e:
                 logging.error(f"Error during processing: {e}")
                 return render_template('index.html', message=f'Error during processing: {e}')
+
+            finally:
+                # The XVID file is only needed until the web copy exists
+                if processed_path is not None:
+                    artifact_store.release(processed_path)
+                if output is not None:
+                    artifact_store.release(output.path)
+                if video_path is not None:
+                    artifact_store.release(video_path)
     
     return render_template('index.html')
 
@@ -258,8 +347,19 @@ def live():
 
     exercise_type = request.form.get('live_exercise_type')
     
+    # Live sessions run on their reserved share of the cores
+    try:
+        ticket = admission.admit_live()
+    except AdmissionRejected as e:
+        return str(e), 429, {'Retry-After': str(e.retry_after)}
+
     # Your live video processing logic goes here
-    response = process_live_video(exercise_type)
+    try:
+        response = process_live_video(exercise_type)
+    except Exception:
+        ticket.release()
+        raise
+    response.call_on_close(ticket.release)
     
     # Add CORS headers to the actual response
     response.headers['Access-Control-Allow-Origin'] = 'http://localhost:3000'
@@ -267,6 +367,16 @@ def live():
     
     return response
 
+@app.route('/storage/metrics', methods=['GET'])
+@cross_origin(origin='*')
+def storage_metrics():
+    return jsonify(artifact_store.metrics())
+
+@app.route('/admission/metrics', methods=['GET'])
+@cross_origin(origin='*')
+def admission_metrics():
+    return jsonify(admission.metrics())
+
 if __name__ == '__main__':
     app.run(debug=True)
 
@@ -0,0 +1,246 @@
+import time
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from movement import MovementAnalyzer
+
+# Threshold used by the crossing counter in onnxapp74.py and streamlit.py
+CROSSING_THRESHOLD = 0.89
+
+
+def to_series(values):
+    """Convert a list of per-frame confidences (None when missing) to a float array with NaN gaps"""
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _next_true(mask):
+    """For every index i, the first index j >= i where mask is set (len(mask) if none)"""
+    n = len(mask)
+    idx = np.where(mask, np.arange(n), n)
+    return np.append(np.minimum.accumulate(idx[::-1])[::-1], n)
+
+
+def smooth(series, window_size):
+    """Moving average matching MovementAnalyzer.smooth_value over a whole series.
+
+    Missing values repeat the previous smoothed-window entry (0 before the first detection).
+    """
+    n = len(series)
+    if n == 0:
+        return np.empty(0)
+
+    # Forward-fill gaps with the last observed value
+    valid = ~np.isnan(series)
+    idx = np.where(valid, np.arange(1, n + 1), 0)
+    np.maximum.accumulate(idx, out=idx)
+    filled = np.concatenate(([0.0], np.where(valid, series, 0.0)))[idx]
+
+    # Trailing window; zero padding keeps the sum order identical to Python's sum()
+    padded = np.concatenate((np.zeros(window_size - 1), filled))
+    windows = sliding_window_view(padded, window_size)
+    sums = windows[:, 0].copy()
+    for col in range(1, window_size):
+        sums += windows[:, col]
+    counts = np.minimum(np.arange(1, n + 1), window_size)
+    return sums / counts
+
+
+def detect_reps(smoothed, rep_start_threshold, rep_end_threshold, min_rep_frames, min_frames_between_reps):
+    """Return the frame indices at which MovementAnalyzer.detect_rep would count a rep.
+
+    Candidate start and end frames are found with array operations; the Python loop only
+    steps from one candidate rep to the next instead of visiting every frame.
+    """
+    n = len(smoothed)
+    next_below = _next_true(smoothed < rep_start_threshold)
+    next_above = _next_true(smoothed > rep_end_threshold)
+
+    rep_frames = []
+    pos = 0
+    last_rep = -1
+    while True:
+        # A rep may only start once the cooldown since the last rep has passed
+        search_from = max(pos, last_rep + min_frames_between_reps + 1)
+        if search_from >= n:
+            break
+        start = next_below[search_from]
+        if start >= n:
+            break
+
+        # Completion needs min_rep_frames of motion; the motion is abandoned after 2x the cooldown
+        earliest_end = start + max(1, min_rep_frames - 1)
+        abandon = start + min_frames_between_reps * 2
+        end = next_above[min(earliest_end, n)]
+        if end < n and end <= abandon:
+            rep_frames.append(end)
+            last_rep = end
+            pos = end + 1
+        else:
+            pos = abandon + 1
+
+    return np.array(rep_frames, dtype=np.int64)
+
+
+def crossing_rep_frames(series, threshold=CROSSING_THRESHOLD):
+    """Frame indices at which the threshold-crossing counter of onnxapp74.py counts a rep.
+
+    Crossings are only counted between two consecutive frames that both have a detection.
+    """
+    prev, cur = series[:-1], series[1:]
+    paired = ~np.isnan(prev) & ~np.isnan(cur)
+    down = paired & (prev > threshold) & (cur <= threshold)
+    up = paired & (prev <= threshold) & (cur > threshold)
+
+    # The state after any crossing is "rep started" iff it was a down crossing,
+    # so an up crossing completes a rep exactly when the previous crossing was down
+    crossings = np.flatnonzero(down | up)
+    is_up = up[crossings]
+    return crossings[1:][is_up[1:] & ~is_up[:-1]] + 1
+
+
+def running_counts(rep_frames, n_frames):
+    """Reps completed up to and including each frame"""
+    return np.searchsorted(rep_frames, np.arange(n_frames), side='right')
+
+
+def score_stats(scores):
+    return {
+        'average': np.mean(scores),
+        'min': scores.min(),
+        'max': scores.max(),
+        'consistency': 1 - (scores.max() - scores.min())
+    }
+
+
+def analyze(form_values, down_values, exercise_type):
+    """Analyze a whole clip in one pass.
+
+    form_values and down_values are per-frame confidences with None for frames without a
+    detection. Returns a dict with the get_metrics() result under 'metrics', the frame index
+    of every rep under 'rep_frames', and per-frame running 'rep_counts' and 'scores' for overlays.
+    """
+    params = MovementAnalyzer(exercise_type)
+    form = to_series(form_values) if not isinstance(form_values, np.ndarray) else form_values
+    down = to_series(down_values) if not isinstance(down_values, np.ndarray) else down_values
+    n = len(form)
+
+    smoothed = smooth(form, params.window_size)
+    rep_frames = detect_reps(
+        smoothed,
+        params.rep_start_threshold,
+        params.rep_end_threshold,
+        params.min_rep_frames,
+        params.min_frames_between_reps
+    )
+    rep_counts = running_counts(rep_frames, n)
+
+    # Running score shown on each frame, NaN until both labels have been seen
+    form_seen = np.cumsum(~np.isnan(form))
+    down_seen = np.cumsum(~np.isnan(down))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        form_mean = np.cumsum(np.nan_to_num(form)) / form_seen
+        down_mean = np.cumsum(np.nan_to_num(down)) / down_seen
+    scores = np.round((form_mean * 0.6 + down_mean * 0.4) * 10, 1)
+
+    form_scores = form[~np.isnan(form)]
+    down_scores = down[~np.isnan(down)]
+    metrics = None
+    if len(form_scores) and len(down_scores):
+        metrics = {
+            'frames_analyzed': len(form_scores),
+            'repetitions': len(rep_frames),
+            'form_metrics': score_stats(form_scores),
+            'depth_metrics': score_stats(down_scores)
+        }
+        overall_score = (metrics['form_metrics']['average'] * 0.6 + metrics['depth_metrics']['average'] * 0.4) * 10
+        metrics['movement_assessment'] = {
+            'form_quality': MovementAnalyzer.get_quality_assessment(metrics['form_metrics']['average']),
+            'depth_quality': MovementAnalyzer.get_quality_assessment(metrics['depth_metrics']['average']),
+            'form_consistency': MovementAnalyzer.get_quality_assessment(metrics['form_metrics']['consistency']),
+            'depth_consistency': MovementAnalyzer.get_quality_assessment(metrics['depth_metrics']['consistency']),
+            'score': round(overall_score, 1)
+        }
+
+    return {
+        'metrics': metrics,
+        'rep_frames': rep_frames,
+        'rep_counts': rep_counts,
+        'scores': scores
+    }
+
+
+def _synthetic_clip(rng, n_frames, missing_rate=0.1):
+    """Noisy rep-like confidence curves with dropped detections"""
+    t = np.arange(n_frames)
+    period = rng.uniform(12, 45)
+    form = 0.88 + 0.08 * np.sin(2 * np.pi * t / period) + rng.normal(0, 0.03, n_frames)
+    down = 0.8 + 0.1 * np.cos(2 * np.pi * t / period) + rng.normal(0, 0.03, n_frames)
+    form = [None if rng.random() < missing_rate else float(v) for v in np.clip(form, 0, 1)]
+    down = [None if rng.random() < missing_rate else float(v) for v in np.clip(down, 0, 1)]
+    return form, down
+
+
+def _loop_crossing_counts(form):
+    """The per-frame crossing counter as written in onnxapp74.py before vectorization"""
+    last_ibw_label = None
+    rep_count = 0
+    rep_started = False
+    counts = []
+    for current_ibw_label in form:
+        if last_ibw_label is not None and current_ibw_label is not None:
+            if not rep_started:
+                if last_ibw_label > CROSSING_THRESHOLD and current_ibw_label <= CROSSING_THRESHOLD:
+                    rep_started = True
+            else:
+                if last_ibw_label <= CROSSING_THRESHOLD and current_ibw_label > CROSSING_THRESHOLD:
+                    rep_count += 1
+                    rep_started = False
+        last_ibw_label = current_ibw_label
+        counts.append(rep_count)
+    return counts
+
+
+def check_parity(n_clips=50, n_frames=2000, seed=0):
+    """Compare analyze() against MovementAnalyzer and crossing_rep_frames() against the
+    original crossing loop, frame by frame on synthetic clips. Raises RuntimeError on a mismatch.
+    """
+    rng = np.random.default_rng(seed)
+    loop_time = 0.0
+    vector_time = 0.0
+    for clip in range(n_clips):
+        exercise_type = 'squat' if clip % 2 else 'sumo_deadlift'
+        form_key = 'ibw' if exercise_type in ['regular_deadlift', 'squat'] else 'up'
+        form, down = _synthetic_clip(rng, n_frames, missing_rate=0.0 if clip == 0 else 0.1)
+
+        start = time.perf_counter()
+        analyzer = MovementAnalyzer(exercise_type)
+        expected_counts = []
+        for f, d in zip(form, down):
+            labels = {}
+            if f is not None:
+                labels[form_key] = f
+            if d is not None:
+                labels['down'] = d
+            analyzer.process_frame(labels)
+            expected_counts.append(analyzer.rep_count)
+        expected = analyzer.get_metrics()
+        loop_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = analyze(form, down, exercise_type)
+        vector_time += time.perf_counter() - start
+
+        if list(result['rep_counts']) != expected_counts:
+            raise RuntimeError(f"rep counts differ on clip {clip}")
+        if result['metrics'] != expected:
+            raise RuntimeError(f"metrics differ on clip {clip}")
+
+        crossing_counts = running_counts(crossing_rep_frames(to_series(form)), len(form))
+        if list(crossing_counts) != _loop_crossing_counts(form):
+            raise RuntimeError(f"crossing rep counts differ on clip {clip}")
+
+    print(f"{n_clips} clips x {n_frames} frames match MovementAnalyzer and the crossing counter "
+          f"(loop {loop_time:.3f}s, vectorized {vector_time:.3f}s)")
+
+
+if __name__ == '__main__':
+    check_parity()
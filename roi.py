@@ -0,0 +1,127 @@
+import math
+import numpy as np
+
+
+class RoiTracker:
+    """Crops frames to a padded box around the lifter's last detection before inference.
+
+    The full frame is used until the lifter is found, every redetect_interval frames, and
+    on the frame after confidence drops below min_confidence. Crops are also run at a
+    smaller inference size when they are smaller than max_imgsz, so fewer pixels go
+    through the model. Keypoints are returned in original frame coordinates.
+    """
+
+    def __init__(self, padding=0.25, redetect_interval=30, min_confidence=0.5,
+                 max_imgsz=640, min_imgsz=320, enabled=True):
+        self.padding = padding
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+        self.max_imgsz = max_imgsz
+        self.min_imgsz = min_imgsz
+        self.enabled = enabled
+        self.box = None  # last lifter box (x1, y1, x2, y2) in frame coordinates
+        self.frames_since_full = 0
+        self.stats = {
+            'frames': 0,
+            'full_frames': 0,
+            'cropped_frames': 0,
+            'input_pixels': 0,
+            'frame_pixels': 0,
+        }
+
+    def reset(self):
+        self.box = None
+        self.frames_since_full = 0
+
+    def region(self, frame):
+        """Return (x1, y1, x2, y2) to run inference on, or None for the full frame"""
+        if not self.enabled or self.box is None or self.frames_since_full >= self.redetect_interval:
+            return None
+
+        height, width = frame.shape[:2]
+        x1, y1, x2, y2 = self.box
+        pad_x = (x2 - x1) * self.padding
+        pad_y = (y2 - y1) * self.padding
+        x1 = max(0, int(x1 - pad_x))
+        y1 = max(0, int(y1 - pad_y))
+        x2 = min(width, int(math.ceil(x2 + pad_x)))
+        y2 = min(height, int(math.ceil(y2 + pad_y)))
+        if x2 - x1 < 32 or y2 - y1 < 32:
+            return None
+        return x1, y1, x2, y2
+
+    def imgsz(self, width, height):
+        """Inference size for a crop: its long side rounded up to the model stride"""
+        size = int(math.ceil(max(width, height) / 32)) * 32
+        return max(self.min_imgsz, min(self.max_imgsz, size))
+
+    def detect(self, model, frame, conf=0.3):
+        """Run model on the current region of frame.
+
+        Returns (labels, keypoints) where labels maps class name to confidence and
+        keypoints is an (N, 2) array for the first person in frame coordinates, or None.
+        Undetected keypoints stay at (0, 0), as the model reports them on a full frame.
+        """
+        region = self.region(frame)
+        if region is None:
+            x1, y1 = 0, 0
+            crop = frame
+            imgsz = self.max_imgsz
+            self.frames_since_full = 0
+            self.stats['full_frames'] += 1
+        else:
+            x1, y1, x2, y2 = region
+            crop = np.ascontiguousarray(frame[y1:y2, x1:x2])
+            imgsz = self.imgsz(x2 - x1, y2 - y1)
+            self.frames_since_full += 1
+            self.stats['cropped_frames'] += 1
+
+        self.stats['frames'] += 1
+        self.stats['frame_pixels'] += frame.shape[0] * frame.shape[1]
+        self.stats['input_pixels'] += crop.shape[0] * crop.shape[1]
+
+        result = model(source=crop, conf=conf, imgsz=imgsz, verbose=False)[0]
+        offset = np.array([x1, y1], dtype=np.float32)
+
+        labels = {}
+        best_conf = 0.0
+        boxes = np.empty((0, 4), dtype=np.float32)
+        if result.boxes is not None and len(result.boxes):
+            for box in result.boxes:
+                class_id = int(box.cls)
+                confidence = float(box.conf)
+                labels[result.names[class_id]] = confidence
+                best_conf = max(best_conf, confidence)
+            boxes = result.boxes.xyxy.cpu().numpy() + np.tile(offset, 2)
+
+        keypoints = None
+        visible = None
+        if getattr(result, 'keypoints', None) is not None and len(result.keypoints.xy):
+            keypoints = result.keypoints.xy[0].cpu().numpy().copy()
+            # Undetected keypoints are reported at (0, 0); leave them there as on a full frame
+            visible = np.any(keypoints != 0, axis=1)
+            keypoints[visible] += offset
+
+        self.update(boxes, keypoints, best_conf, visible)
+        return labels, keypoints
+
+    def update(self, boxes, keypoints, confidence, visible=None):
+        """Track the union of all detections as the lifter's box; visible masks out undetected keypoints"""
+        if confidence < self.min_confidence or not len(boxes):
+            # Lost the lifter, look at the whole frame next time
+            self.box = None
+            return
+
+        points = [boxes[:, :2], boxes[:, 2:]]
+        if keypoints is not None:
+            points.append(keypoints if visible is None else keypoints[visible])
+        points = np.concatenate(points)
+        x1, y1 = points.min(axis=0)
+        x2, y2 = points.max(axis=0)
+        self.box = (float(x1), float(y1), float(x2), float(y2))
+
+    def pixel_ratio(self):
+        """Fraction of frame pixels that were actually sent to the model"""
+        if not self.stats['frame_pixels']:
+            return 1.0
+        return self.stats['input_pixels'] / self.stats['frame_pixels']
@@ -0,0 +1,250 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Artifact kinds tracked by the store
+INPUT = 'input'                # raw uploads, deduplicated by content hash
+INTERMEDIATE = 'intermediate'  # XVID files that only live until transcoding finishes
+OUTPUT = 'output'              # web MP4s served back to the browser
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Artifact:
+    def __init__(self, path, kind, key=None, meta=None):
+        self.path = path
+        self.kind = kind
+        self.key = key
+        self.meta = meta
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.last_access = time.time()
+        self.pins = 0
+
+
+class ArtifactStore:
+    """Tracks every file produced for an upload and keeps them within a disk budget"""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.artifacts = {}  # path -> Artifact
+        self.by_key = {}     # (kind, key) -> path
+        self.lock = threading.Lock()
+        self.in_flight = {}  # (kind, key) -> [lock, waiters] for artifacts being produced
+        self.stats = {
+            'bytes_reclaimed': 0,
+            'files_deleted': 0,
+            'evictions': 0,
+            'dedup_hits': 0,
+            'cache_hits': 0,
+        }
+
+    def save_input(self, file_storage, folder, extension):
+        """Stream an upload to disk, naming it by content hash so identical uploads are stored once.
+
+        Returns (path, digest). The returned path is pinned and must be released by the caller.
+        """
+        digest = hashlib.sha256()
+        tmp_path = os.path.join(folder, f'.upload_{threading.get_ident()}_{time.time_ns()}')
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = file_storage.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            # scan() skips dotfiles, so a partial upload would never be reclaimed
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        digest = digest.hexdigest()
+        path = os.path.join(folder, f'{digest}{extension}')
+
+        with self.lock:
+            existing = self.by_key.get((INPUT, digest))
+            if existing is not None and os.path.exists(existing):
+                os.remove(tmp_path)
+                self.stats['dedup_hits'] += 1
+                artifact = self.artifacts[existing]
+                artifact.last_access = time.time()
+                artifact.pins += 1
+                logger.debug(f"Duplicate upload {digest}, reusing {existing}")
+                return existing, digest
+
+            os.replace(tmp_path, path)
+            artifact = self._register(path, INPUT, digest)
+            artifact.pins += 1
+
+        self.enforce_budget()
+        return path, digest
+
+    def register(self, path, kind, key=None, meta=None, pin=False):
+        """Start tracking a file that was written outside the store"""
+        with self.lock:
+            artifact = self._register(path, kind, key, meta)
+            if pin:
+                artifact.pins += 1
+        if kind != INTERMEDIATE:
+            self.enforce_budget()
+        return artifact
+
+    def lookup(self, kind, key, pin=False):
+        """Return the artifact stored under key, refreshing its last access time.
+
+        With pin=True the artifact is pinned and must be released by the caller.
+        """
+        with self.lock:
+            path = self.by_key.get((kind, key))
+            if path is None:
+                return None
+            if not os.path.exists(path):
+                self._forget(path)
+                return None
+            artifact = self.artifacts[path]
+            artifact.last_access = time.time()
+            if pin:
+                artifact.pins += 1
+            self.stats['cache_hits'] += 1
+            return artifact
+
+    @contextmanager
+    def producing(self, kind, key):
+        """Run the block while no other request is producing the artifact for (kind, key).
+
+        Identical requests that arrive together queue here instead of writing the same
+        files at once. Callers should lookup() again inside the block; a request that
+        waited finds the first request's result there.
+        """
+        with self.lock:
+            entry = self.in_flight.setdefault((kind, key), [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.in_flight[(kind, key)]
+
+    def touch(self, path):
+        """Refresh last access time, e.g. when an output is served"""
+        with self.lock:
+            artifact = self.artifacts.get(path)
+            if artifact is not None:
+                artifact.last_access = time.time()
+
+    def release(self, path):
+        """Drop a pin taken by save_input, register or lookup; intermediates are deleted straight away"""
+        with self.lock:
+            artifact = self.artifacts.get(path)
+            if artifact is None:
+                return
+            artifact.pins = max(0, artifact.pins - 1)
+            if artifact.kind == INTERMEDIATE and artifact.pins == 0:
+                self._delete(path)
+
+    def discard(self, path):
+        """Delete an artifact regardless of kind, e.g. after a failed processing run"""
+        with self.lock:
+            if path in self.artifacts:
+                self._delete(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def enforce_budget(self):
+        """Evict least recently used unpinned artifacts until usage fits the budget"""
+        with self.lock:
+            used = self._bytes_used()
+            if used <= self.budget_bytes:
+                return
+            candidates = sorted(
+                (a for a in self.artifacts.values() if a.pins == 0),
+                key=lambda a: a.last_access
+            )
+            for artifact in candidates:
+                if used <= self.budget_bytes:
+                    break
+                used -= artifact.size
+                self._delete(artifact.path)
+                self.stats['evictions'] += 1
+            if used > self.budget_bytes:
+                logger.warning(f"Storage over budget by {used - self.budget_bytes} bytes, remaining files are in use")
+
+    def scan(self, folder, kind, prefix='', suffix=''):
+        """Register files left over from a previous run. Leftover intermediates are removed."""
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not os.path.isfile(path) or name.startswith('.'):
+                continue
+            if not (name.startswith(prefix) and name.endswith(suffix)):
+                continue
+            if kind == INTERMEDIATE:
+                self.discard(path)
+                continue
+            if kind == INPUT:
+                key = os.path.splitext(name)[0]
+            else:
+                key = name[len(prefix):len(name) - len(suffix)]
+            with self.lock:
+                artifact = self._register(path, kind, key)
+                artifact.last_access = os.path.getatime(path)
+        self.enforce_budget()
+
+    def metrics(self):
+        with self.lock:
+            by_kind = {INPUT: 0, INTERMEDIATE: 0, OUTPUT: 0}
+            for artifact in self.artifacts.values():
+                by_kind[artifact.kind] += artifact.size
+            return {
+                'budget_bytes': self.budget_bytes,
+                'bytes_used': sum(by_kind.values()),
+                'bytes_by_kind': by_kind,
+                'files': len(self.artifacts),
+                **self.stats
+            }
+
+    def _register(self, path, kind, key=None, meta=None):
+        artifact = self.artifacts.get(path)
+        if artifact is None:
+            artifact = Artifact(path, kind, key, meta)
+            self.artifacts[path] = artifact
+        else:
+            artifact.size = os.path.getsize(path) if os.path.exists(path) else 0
+            artifact.last_access = time.time()
+            if meta is not None:
+                artifact.meta = meta
+        if key is not None:
+            self.by_key[(kind, key)] = path
+        return artifact
+
+    def _forget(self, path):
+        artifact = self.artifacts.pop(path, None)
+        if artifact is not None and artifact.key is not None:
+            if self.by_key.get((artifact.kind, artifact.key)) == path:
+                del self.by_key[(artifact.kind, artifact.key)]
+        return artifact
+
+    def _delete(self, path):
+        artifact = self._forget(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.error(f"Error deleting {path}: {e}")
+            return
+        if artifact is not None:
+            self.stats['bytes_reclaimed'] += artifact.size
+        self.stats['files_deleted'] += 1
+        logger.debug(f"Deleted {path}")
+
+    def _bytes_used(self):
+        return sum(a.size for a in self.artifacts.values())
@@ -1,25 +1,42 @@
 import os
+import time
 import logging
+import threading
 import cv2
 import numpy as np
-from ultralytics import YOLO
+from model_cache import load_model, warm_up
 import streamlit as st
 from pathlib import Path
 from moviepy.editor import ImageSequenceClip
+from roi import RoiTracker
+from live_source import open_live_source, LatencyTracer
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
-# Load YOLO models
-yolo_models = {
-    'regular_deadlift': YOLO("muscleAi_weights/best.pt"),
-    'sumo_deadlift': YOLO("muscleAi_weights/sumo_best.pt"),
-    'squat': YOLO("muscleAi_weights/squats_best.pt"),
-    'romanian_deadlift': YOLO("muscleAi_weights/best_romanian.pt"),
-    "zercher_squat": YOLO("muscleAi_weights/zercher_best.pt"),
-    "front_squat": YOLO("muscleAi_weights/front_squats_best.pt")
+# Model weights per exercise type
+MODEL_PATHS = {
+    'regular_deadlift': "muscleAi_weights/best.pt",
+    'sumo_deadlift': "muscleAi_weights/sumo_best.pt",
+    'squat': "muscleAi_weights/squats_best.pt",
+    'romanian_deadlift': "muscleAi_weights/best_romanian.pt",
+    "zercher_squat": "muscleAi_weights/zercher_best.pt",
+    "front_squat": "muscleAi_weights/front_squats_best.pt"
 }
 
+# Streamlit reruns this script on every interaction, so models are cached process-wide
+@st.cache_resource
+def load_yolo_model(exercise_type):
+    logging.info(f"Loading YOLO model for {exercise_type}")
+    model, source = load_model(MODEL_PATHS[exercise_type])
+    warm_up(model)
+    logging.info(f"Model {exercise_type} warm from {source}")
+    return model
+
+@st.cache_resource
+def get_model_lock(exercise_type):
+    return threading.Lock()
+
 # Function to check for injury risk (unchanged)
 def check_injury_risk(labels, exercise_type):
     if exercise_type in ['regular_deadlift', 'squat']:
@@ -38,72 +55,206 @@ def draw_keypoints(frame, keypoints):
         cv2.circle(frame, (x, y), 5, (0, 255, 0), -1)
     return frame
 
-# Function to process video with YOLO
-def process_video_with_yolo(video_path, exercise_type):
-    processed_frames = []
-    
-    yolo_model = yolo_models[exercise_type]
-    
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        st.error("Error opening video file")
-        return None
+# A job whose page has stopped polling for this long (e.g. the tab was closed) stops itself
+ORPHAN_TIMEOUT_SECONDS = 10
+
+# Inference job that runs in a background thread and publishes its latest state.
+# Streamlit calls must stay on the script thread, so the job only stores results
+# and the page polls them.
+class ProcessingJob:
+    def __init__(self, exercise_type, source, keep_frames=False, roi_mode=True):
+        self.exercise_type = exercise_type
+        # Resolve cached resources on the script thread
+        self.yolo_model = load_yolo_model(exercise_type)
+        self.model_lock = get_model_lock(exercise_type)
+        self.source = source
+        self.keep_frames = keep_frames
+        self.roi_tracker = RoiTracker(enabled=roi_mode)
+        self.fps = 30
+        self.processed_frames = []
+        self.latest_frame = None
+        self.injury_risk = "No significant risk"
+        self.rep_count = 0
+        self.frames_done = 0
+        self.error = None
+        self.latency_report = None
+        self.done = False
+        self.lock = threading.Lock()
+        self.cancel_event = threading.Event()
+        self.last_poll = time.monotonic()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def heartbeat(self):
+        """Called by the page on every poll; a job nobody polls is cancelled"""
+        self.last_poll = time.monotonic()
+
+    def orphaned(self):
+        return time.monotonic() - self.last_poll > ORPHAN_TIMEOUT_SECONDS
+
+    def snapshot(self):
+        with self.lock:
+            return self.latest_frame, self.injury_risk, self.rep_count, self.frames_done
+
+    def run(self):
+        try:
+            self.process()
+        except Exception as e:
+            logging.error(f"Error processing video: {e}")
+            self.error = str(e)
+        finally:
+            self.done = True
+
+    def process(self):
+        # source None means live: webcam by default, or the file set in LIVE_SOURCE
+        if self.source is None:
+            cap = open_live_source()
+            tracer = LatencyTracer(cap)
+        else:
+            cap = cv2.VideoCapture(self.source)
+            tracer = None
+        if not cap.isOpened():
+            raise IOError("Error opening video source")
+
+        # Get original video FPS
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps else 30  # fallback value
+
+        last_ibw_label = None
+        rep_count = 0
+        rep_started = False
+
+        try:
+            while not self.cancelled:
+                if self.orphaned():
+                    # Nothing has rendered this job for a while; free the source and the model lock
+                    logging.info(f"Stopping {self.exercise_type} job, its page is no longer polling")
+                    self.cancel()
+                    break
+
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                trace = tracer.start_frame() if tracer else None
+
+                # Predictors are shared between sessions and are not thread-safe.
+                # Inference runs on a crop around the lifter; keypoints come back in frame coordinates
+                with self.model_lock:
+                    labels, keypoints = self.roi_tracker.detect(self.yolo_model, frame, conf=0.3)
+                if trace:
+                    trace.mark('inference')
+
+                injury_risk = check_injury_risk(labels, self.exercise_type)
+
+                current_ibw_label = labels.get('ibw') if self.exercise_type in ['regular_deadlift', 'squat'] else labels.get('up')
+
+                if last_ibw_label is not None and current_ibw_label is not None:
+                    if not rep_started:
+                        if last_ibw_label > 0.89 and current_ibw_label <= 0.89:
+                            rep_started = True
+                    else:
+                        if last_ibw_label <= 0.89 and current_ibw_label > 0.89:
+                            rep_count += 1
+                            rep_started = False
+
+                last_ibw_label = current_ibw_label
+
+                if keypoints is not None:
+                    frame = draw_keypoints(frame, keypoints)
+
+                cv2.putText(frame, f"Injury Risk: {injury_risk}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                cv2.putText(frame, f"Repetitions: {rep_count}", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                if trace:
+                    trace.mark('overlay')
 
-    # Get original video FPS
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps == 0:
-        fps = 30  # fallback value
+                # Convert BGR to RGB for Streamlit and MoviePy
+                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                if trace:
+                    trace.mark('convert')
+                    tracer.finish(trace)
+                if self.keep_frames:
+                    self.processed_frames.append(frame_rgb)
 
-    last_ibw_label = None
-    rep_count = 0
-    rep_started = False
+                with self.lock:
+                    self.latest_frame = frame_rgb
+                    self.injury_risk = injury_risk
+                    self.rep_count = rep_count
+                    self.frames_done += 1
+        finally:
+            cap.release()
+            if tracer:
+                self.latency_report = tracer.report()
+                logging.info(f"Live session latency: {self.latency_report}")
 
+
+def render_job(job, poll_interval=0.05):
+    """Stream the job's frames and metrics into the page until it finishes"""
+    stframe = st.empty()
+    metrics_placeholder = st.empty()
+
+    last_rendered = -1
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        job.heartbeat()
+        done = job.done
+        frame_rgb, injury_risk, rep_count, frames_done = job.snapshot()
+        # Only push a new frame to the browser when inference produced one
+        if frame_rgb is not None and frames_done != last_rendered:
+            stframe.image(frame_rgb, channels="RGB", use_column_width=True)
+            metrics_placeholder.text(f"Injury Risk: {injury_risk}\nRepetitions: {rep_count}\nFrames: {frames_done}")
+            last_rendered = frames_done
+        if done:
             break
-        
-        results = yolo_model(source=frame, stream=True, conf=0.3)
-        
-        for result in results:
-            frame = result.orig_img
-            
-            labels = {result.names[int(box.cls)]: float(box.conf) for box in result.boxes} if result.boxes is not None else {}
-            injury_risk = check_injury_risk(labels, exercise_type)
-
-            current_ibw_label = labels.get('ibw') if exercise_type in ['regular_deadlift', 'squat'] else labels.get('up')
-            
-            if last_ibw_label is not None and current_ibw_label is not None:
-                if not rep_started:
-                    if last_ibw_label > 0.89 and current_ibw_label <= 0.89:
-                        rep_started = True
-                else:
-                    if last_ibw_label <= 0.89 and current_ibw_label > 0.89:
-                        rep_count += 1
-                        rep_started = False
-
-            last_ibw_label = current_ibw_label
-
-            if hasattr(result, 'keypoints') and result.keypoints is not None:
-                keypoints = result.keypoints.xy[0]
-                frame = draw_keypoints(frame, keypoints)
-
-            cv2.putText(frame, f"Injury Risk: {injury_risk}", (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-            cv2.putText(frame, f"Repetitions: {rep_count}", (50, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-
-            # Convert BGR to RGB for MoviePy
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            processed_frames.append(frame_rgb)
-
-    cap.release()
-    
-    return processed_frames, fps
+        time.sleep(poll_interval)
+
+
+def save_processed_video(job, output_video_path):
+    try:
+        # Create video using MoviePy
+        clip = ImageSequenceClip(job.processed_frames, fps=job.fps)
+
+        # Write video with good quality
+        clip.write_videofile(
+            str(output_video_path),
+            codec='libx264',
+            fps=job.fps,
+            preset='medium',
+            bitrate='8000k',
+            audio=False
+        )
+
+        # Read the processed video for display
+        with open(output_video_path, 'rb') as video_file:
+            video_bytes = video_file.read()
+
+        # Display the processed video
+        st.success("Video processed successfully!")
+        st.video(video_bytes)
+
+    except Exception as e:
+        st.error(f"Error creating video: {str(e)}")
+    finally:
+        # Clean up MoviePy clip
+        if 'clip' in locals():
+            clip.close()
+
 
 # Streamlit UI
 st.title("Aligno")
 
-exercise_type = st.selectbox("Select Exercise Type", list(yolo_models.keys()))
+exercise_type = st.selectbox("Select Exercise Type", list(MODEL_PATHS.keys()))
+roi_mode = st.checkbox("Track lifter (crop frames before inference)", value=True)
+
+job = st.session_state.get('job')
 
 uploaded_file = st.file_uploader("Upload a Video", type=["mp4", "mov"])
 
@@ -115,111 +266,50 @@ if uploaded_file is not None:
     video_dir.mkdir(exist_ok=True)
     processed_dir.mkdir(exist_ok=True)
 
-    # Save uploaded video
+    # Save uploaded video once per upload; reruns with the same upload reuse the file
     video_path = video_dir / uploaded_file.name
-    with open(video_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    if st.session_state.get('saved_upload') != (uploaded_file.file_id, str(video_path)):
+        with open(video_path, "wb") as f:
+            f.write(uploaded_file.getbuffer())
+        st.session_state['saved_upload'] = (uploaded_file.file_id, str(video_path))
 
     if st.button("Process Video"):
-        with st.spinner('Processing video...'):
-            # Process the video
-            processed_frames, fps = process_video_with_yolo(str(video_path), exercise_type)
-
-            if processed_frames is not None:
-                # Generate output path
-                output_filename = f'processed_{Path(uploaded_file.name).stem}.mp4'
-                output_video_path = processed_dir / output_filename
-                
-                try:
-                    # Create video using MoviePy
-                    clip = ImageSequenceClip(processed_frames, fps=fps)
-                    
-                    # Write video with good quality
-                    clip.write_videofile(
-                        str(output_video_path),
-                        codec='libx264',
-                        fps=fps,
-                        preset='medium',
-                        bitrate='8000k',
-                        audio=False
-                    )
-                    
-                    # Read the processed video for display
-                    with open(output_video_path, 'rb') as video_file:
-                        video_bytes = video_file.read()
-                    
-                    # Display the processed video
-                    st.success("Video processed successfully!")
-                    st.video(video_bytes)
-                    
-                except Exception as e:
-                    st.error(f"Error creating video: {str(e)}")
-                finally:
-                    # Clean up MoviePy clip
-                    if 'clip' in locals():
-                        clip.close()
-
-def process_live_video(exercise_type):
-    cap = cv2.VideoCapture(0)
-    
-    if not cap.isOpened():
-        st.error("Error opening webcam")
-        return
-
-    # Create placeholder for video frame
-    stframe = st.empty()
-    
-    # Create placeholders for metrics
-    metrics_placeholder = st.empty()
-    
-    last_ibw_label = None
-    rep_count = 0
-    rep_started = False
-    
-    stop_button = st.button("Stop Stream")
+        if job is not None:
+            job.cancel()
+        job = ProcessingJob(exercise_type, str(video_path), keep_frames=True, roi_mode=roi_mode).start()
+        st.session_state['job'] = job
+        st.session_state['output_video_path'] = processed_dir / f'processed_{Path(uploaded_file.name).stem}.mp4'
 
-    while not stop_button:
-        ret, frame = cap.read()
-        if not ret:
-            st.error("Error reading from webcam")
-            break
-        
-        results = yolo_models[exercise_type](source=frame, stream=True, conf=0.3)
-        
-        for result in results:
-            frame = result.orig_img
-            
-            labels = {result.names[int(box.cls)]: float(box.conf) for box in result.boxes} if result.boxes is not None else {}
-            injury_risk = check_injury_risk(labels, exercise_type)
-
-            current_ibw_label = labels.get('ibw') if exercise_type in ['regular_deadlift', 'squat'] else labels.get('up')
-            
-            if last_ibw_label is not None and current_ibw_label is not None:
-                if not rep_started:
-                    if last_ibw_label > 0.89 and current_ibw_label <= 0.89:
-                        rep_started = True
-                else:
-                    if last_ibw_label <= 0.89 and current_ibw_label > 0.89:
-                        rep_count += 1
-                        rep_started = False
-
-            last_ibw_label = current_ibw_label
-
-            # Draw keypoints if available
-            if hasattr(result, 'keypoints') and result.keypoints is not None:
-                keypoints = result.keypoints.xy[0]
-                frame = draw_keypoints(frame, keypoints)
-
-            # Convert BGR to RGB for Streamlit
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            
-            # Update frame
-            stframe.image(frame_rgb, channels="RGB", use_column_width=True)
-            
-            # Update metrics
-            metrics_placeholder.text(f"Injury Risk: {injury_risk}\nRepetitions: {rep_count}")
+if st.button("Start Live Stream"):
+    if job is not None:
+        job.cancel()
+    job = ProcessingJob(exercise_type, None, roi_mode=roi_mode).start()
+    st.session_state['job'] = job
+    st.session_state['output_video_path'] = None
 
-    cap.release()
+# Clicking Cancel triggers a rerun, which stops the polling loop of the previous run;
+# setting the event stops inference in the background thread right away
+if job is not None and not job.done:
+    if st.button("Cancel", key="cancel_job"):
+        job.cancel()
+        # Let the job finish its current frame so the latency report covers the whole session
+        job.thread.join(timeout=5)
+        st.warning("Processing cancelled")
 
-if st.button("Start Live Stream"):
-    process_live_video(exercise_type)
+if job is not None and job.cancelled:
+    # Webcam and looping replay streams only end through Cancel, so their report is shown here
+    if job.latency_report is not None:
+        st.json(job.latency_report)
+# Reattach to a running job after any rerun so output keeps streaming
+elif job is not None:
+    render_job(job)
+    if job.error is not None:
+        st.error(f"Error processing video: {job.error}")
+    elif job.latency_report is not None:
+        st.json(job.latency_report)
+    elif job.keep_frames and st.session_state.get('output_video_path') is not None:
+        with st.spinner('Writing video...'):
+            save_processed_video(job, st.session_state['output_video_path'])
+        # Free the frames once the video is on disk
+        job.processed_frames = []
+        st.session_state['output_video_path'] = None